@@ -0,0 +1,94 @@
+# coding=utf-8
+
+
+"""
+Content hashes of stage inputs for incremental rebuilds.
+"""
+
+import hashlib
+import json
+from os import replace
+from os.path import exists
+from os.path import join
+from os.path import relpath
+
+from .util import read_json_to_obj
+
+
+class BuildCache:
+    """
+    Make-style record of the work items a stage has already built.
+
+    For every work item of a stage (a pdf, a page, a page directory) the build
+    manifest keeps a hash of its input files and of the effective stage config.
+    A work item is current, if that hash did not change and its outputs exist.
+    """
+
+    file_name = '.build_manifest.json'
+    # Digest of a work item with a missing input, it is never recorded.
+    missing = 'missing'
+
+    def __init__(self, root: str, stage: str, params: object, file_name=None):
+        self.root = root
+        self.stage = stage
+        self.path = join(root, file_name or BuildCache.file_name)
+        self.params_digest = BuildCache.hash_params(params)
+        self.manifest = read_json_to_obj(self.path) or {}
+        self.entries = self.manifest.setdefault(stage, {})
+
+    @staticmethod
+    def hash_params(params: object) -> str:
+        dump = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha1(dump.encode('utf-8')).hexdigest()
+
+    def digest(self, input_paths: list) -> str:
+        """
+        Hashes the stage config together with names and contents of the input files.
+        Returns None, if an input file is missing.
+        """
+        digest = hashlib.sha1(self.params_digest.encode('utf-8'))
+        for path in input_paths:
+            if not exists(path):
+                return None
+            digest.update(relpath(path, self.root).encode('utf-8') + b'\0')
+            with open(path, mode='rb') as fp:
+                for chunk in iter(lambda: fp.read(1 << 20), b''):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    def outdated(self, key: str, input_paths: list, output_paths=()) -> str:
+        """
+        Returns the new digest, if the work item key has to be rebuilt.
+        Returns None, if the work item is current.
+        """
+        digest = self.digest(input_paths)
+        if digest is None:
+            # Built again, so that the stage itself reports the missing input.
+            return BuildCache.missing
+        if self.entries.get(key) != digest:
+            return digest
+        if not all(exists(path) for path in output_paths):
+            return digest
+        return None
+
+    def record(self, key: str, digest: str) -> None:
+        if digest is None or digest == BuildCache.missing:
+            self.entries.pop(key, None)
+        else:
+            self.entries[key] = digest
+
+    def key(self, path: str) -> str:
+        return relpath(path, self.root)
+
+    def save(self) -> bool:
+        """
+        Writes the build manifest, replacing the old one in a single step.
+        """
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, mode='w', encoding='utf-8') as fp:
+                json.dump(self.manifest, fp, sort_keys=True, separators=(',', ':'))
+            replace(tmp_path, self.path)
+            return True
+        except Exception as e:
+            raise Exception("Could not write build manifest {0}: {1}".format(self.path, repr(e)))
@@ -0,0 +1,167 @@
+# coding=utf-8
+
+
+"""
+Listing of the corpus tree, shared by all stages of a run.
+"""
+
+from os import scandir
+from os.path import basename
+from os.path import dirname
+from os.path import join
+from os.path import normpath
+from threading import Lock
+
+from .util import natural_keys
+
+
+class _Listing:
+    """
+    Files and subdirectories of one directory with their natural sort keys.
+    """
+
+    def __init__(self, files: dict, dirs: dict):
+        self.files = files
+        self.dirs = dirs
+        self.sorted_files = None
+        self.sorted_dirs = None
+
+    def file_names(self) -> list:
+        if self.sorted_files is None:
+            self.sorted_files = sorted(self.files, key=self.files.get)
+        return self.sorted_files
+
+    def dir_names(self) -> list:
+        if self.sorted_dirs is None:
+            self.sorted_dirs = sorted(self.dirs, key=self.dirs.get)
+        return self.sorted_dirs
+
+
+class Catalog:
+    """
+    Documents, pages and crops of the corpus, listed once with os.scandir.
+
+    A directory is read at its first lookup, or up front for a whole tree
+    with scan(). Its files and subdirectories are kept with precomputed
+    natural sort keys, walk_dir() and list_sub_dirs() return the same as
+    the functions of app.util without touching the file system again.
+
+    Stages report the files and directories they write, rename or remove,
+    so that the listings stay current. Changes that are not reported in
+    detail, like the output of ghostscript, forget() the directory, which
+    is then read again at its next lookup.
+
+    Worker processes get an empty copy.
+    """
+
+    def __init__(self):
+        self.__listings = {}
+        self.__lock = Lock()
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    @staticmethod
+    def __read(path: str) -> _Listing:
+        files, dirs = {}, {}
+        try:
+            for entry in scandir(path):
+                if entry.is_dir():
+                    dirs[entry.name] = natural_keys(entry.name)
+                else:
+                    files[entry.name] = natural_keys(entry.name)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            raise Exception("Could not read {0}: {1}".format(path, repr(e)))
+        return _Listing(files, dirs)
+
+    def __listing(self, path: str) -> _Listing:
+        key = normpath(path)
+        with self.__lock:
+            listing = self.__listings.get(key)
+        if listing is None:
+            listing = self.__read(path)
+            with self.__lock:
+                listing = self.__listings.setdefault(key, listing)
+        return listing
+
+    def scan(self, root: str, depth=2) -> None:
+        """
+        Reads root and its subdirectories down to depth, e.g. documents and pages.
+        """
+        listing = self.__listing(root)
+        if depth > 0:
+            for name in listing.dir_names():
+                self.scan(join(root, name), depth - 1)
+
+    def walk_dir(self, path: str, file_type: str) -> list:
+        """
+        Files of path ending with file_type, in natural order.
+        """
+        listing = self.__listing(path)
+        with self.__lock:
+            names = listing.file_names()
+        return [join(path, name) for name in names if name.endswith(file_type)]
+
+    def list_sub_dirs(self, path: str) -> list:
+        """
+        Subdirectories of path, in natural order.
+        """
+        listing = self.__listing(path)
+        with self.__lock:
+            names = listing.dir_names()
+        return [join(path, name) for name in names]
+
+    def __update(self, path: str, dirs: bool, add: bool) -> None:
+        with self.__lock:
+            listing = self.__listings.get(normpath(dirname(path)))
+            if listing is None:
+                return
+            name = basename(path)
+            entries = listing.dirs if dirs else listing.files
+            if add:
+                if name in entries:
+                    return
+                entries[name] = natural_keys(name)
+            elif entries.pop(name, None) is None:
+                return
+            if dirs:
+                listing.sorted_dirs = None
+            else:
+                listing.sorted_files = None
+
+    def add_file(self, path: str) -> None:
+        self.__update(path, dirs=False, add=True)
+
+    def remove_file(self, path: str) -> None:
+        self.__update(path, dirs=False, add=False)
+
+    def rename_file(self, old_path: str, new_path: str) -> None:
+        self.remove_file(old_path)
+        self.add_file(new_path)
+
+    def add_dir(self, path: str, empty=False) -> None:
+        """
+        Adds the directory path. Its content is read at its next lookup,
+        unless it is known to be empty.
+        """
+        self.__update(path, dirs=True, add=True)
+        self.forget(path)
+        if empty:
+            with self.__lock:
+                self.__listings[normpath(path)] = _Listing({}, {})
+
+    def forget(self, path: str, below=True) -> None:
+        """
+        Drops the listings of path and, unless below is False, of all directories below it.
+        """
+        key = normpath(path)
+        prefix = join(key, '')
+        with self.__lock:
+            for listed in [listed for listed in self.__listings
+                           if listed == key or (below and listed.startswith(prefix))]:
+                del self.__listings[listed]
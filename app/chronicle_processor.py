@@ -7,10 +7,15 @@ Arranges the four major text parts of the chronicle.
 from os import rename
 from os.path import basename
 from os.path import dirname
+from os.path import exists
+from os.path import join
 
-from skimage.io import imread
-from .util import list_sub_dirs
-from .util import walk_dir
+from .build_cache import BuildCache
+from .shard import page_key
+from .util import dump_layout_manifest
+from .util import image_size
+from .util import layout_manifest_name
+from .util import read_layout_manifest
 
 
 class ChronicleProcessor:
@@ -21,58 +26,72 @@ class ChronicleProcessor:
             raise TypeError('Need instance of Config class!')
         self.conf = conf
 
-    def __arrange_text(self, in_dir: str, original_size: tuple) -> dict:
+    def __arrange_text(self, components: list, fragments: dict) -> dict:
         """
-        :param in_dir: Directory with single document pages as images.
-        :param original_size: Original resolution of the document.
+        :param components: Crop images of a page in reading order.
+        :param fragments: Dictionary with lists of component indices for each text part.
         :return: Dictionary with lists of correponding text fragments, where text
                 text fragments are the absolute path of the cutted PNGs.
         """
-        page_width = original_size[1]
-        image_type = self.conf.image_type
-        layout_components = walk_dir(in_dir, file_type=image_type)
-        # Maybe no output by image processing, so need to be checked manually!
-        if not layout_components or layout_components == []:
-            raise Exception("No images found in {0}".format(in_dir))
-
-        images = []
-
-        text_fragments = {'political': [],
-                          'misc': [],
-                          'eccles': [],
-                          'footnotes': []}
+        text_fragments = {frag: [components[i] for i in indices] for frag, indices in fragments.items()}
+        self._rename_fragments(text_fragments)
+        return text_fragments
 
-        for component in layout_components:
-            im = imread(component, as_grey=True)
-            if im is None:
-                print('{0} not found'.format(component))
-                continue
-            images.append({'component': component, 'image': im})
-        for i, im in enumerate(images):
-            image_width = im['image'].shape[1]
-            if image_width / page_width >= 0.5\
-                    and not (text_fragments['misc'] or text_fragments['eccles'])\
-                    and i < len(images) - 1:
-                text_fragments['political'].append(im['component'])
-                continue
-            if (image_width / page_width < 0.5) and not text_fragments['misc']:
-                text_fragments['misc'].append(im['component'])
-                continue
-            if (image_width / page_width < 0.5) and not text_fragments['eccles']:
-                text_fragments['eccles'].append(im['component'])
-                continue
-            if (image_width / page_width >= 0.5) and i >= len(images) - 2:
-                text_fragments['footnotes'].append(im['component'])
-                continue
-        if not text_fragments:
-            new_name = in_dir
-            if in_dir.endswith('/'):
-                new_name = in_dir[:-1]
-            new_name += '_unchecked/'
-            if '_unchecked' not in in_dir:
-                rename(in_dir, new_name)
+    @staticmethod
+    def assign_fragments(widths: list, page_width: int) -> dict:
+        """
+        :param widths: Widths of the layout components of a page in reading order.
+        :param page_width: Width of the original page.
+        :return: Dictionary with lists of component indices for each text part.
+        """
+        return ChronicleProcessor.assign_volume([widths], [page_width])[0]
 
-        return text_fragments
+    @staticmethod
+    def assign_volume(widths: list, page_widths: list) -> list:
+        """
+        :param widths: Widths of the layout components of every page of a volume in reading order.
+        :param page_widths: Width of every original page.
+        :return: Dictionary with lists of component indices for each text part, for every page.
+
+        Components of at least half the page width are political text before
+        the first narrow component, and footnotes among the last two of a page.
+        The first narrow component is misc, the second one eccles.
+        All pages are assigned at once.
+        """
+        import numpy as np
+
+        flat = np.array([width for page in widths for width in page], dtype=np.float64)
+        counts = np.array([len(page) for page in widths], dtype=np.int64)
+        starts = np.cumsum(counts) - counts
+        page = np.repeat(np.arange(len(widths)), counts)
+        index = np.arange(len(flat)) - starts[page]
+        last = counts[page] - 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = flat / np.repeat(np.asarray(page_widths, dtype=np.float64), counts)
+        wide = ratio >= 0.5
+        narrow = ratio < 0.5
+
+        # Number of narrow components up to each one within its page.
+        narrow_seen = np.cumsum(narrow)
+        narrow_seen -= np.concatenate(([0], narrow_seen))[starts][page]
+
+        names = ('political', 'misc', 'eccles', 'footnotes')
+        labels = np.full(len(flat), -1, dtype=np.int64)
+        political = wide & (narrow_seen == 0) & (index < last)
+        labels[political] = 0
+        labels[narrow & (narrow_seen == 1)] = 1
+        labels[narrow & (narrow_seen == 2)] = 2
+        labels[wide & ~political & (index >= last - 1)] = 3
+
+        # Group the indices by page and text part, in reading order.
+        assigned = labels >= 0
+        groups = page[assigned] * len(names) + labels[assigned]
+        members = index[assigned][np.argsort(groups, kind='stable')].tolist()
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(groups, minlength=len(names) * len(widths))))).tolist()
+        fragments = []
+        for first in range(0, len(names) * len(widths), len(names)):
+            fragments.append({name: members[bounds[first + k]:bounds[first + k + 1]] for k, name in enumerate(names)})
+        return fragments
 
     def _rename_fragments(self, fragments: dict):
         if not fragments:
@@ -88,38 +107,120 @@ class ChronicleProcessor:
                 if frag not in file:
                     try:
                         rename(file, new_name)
+                        self.conf.catalog.rename_file(file, new_name)
                     except:
                         raise Exception("Could not rename layout component {0} to new name: {1}".format(file, new_name))
 
-    def __process_page(self, in_dir) -> bool:
-        file_type = self.conf.image_type
-        dirs = list_sub_dirs(in_dir)
-        if not dirs:
+    def __arrange_manifest(self, in_dir: str, manifest: dict, fragments: dict) -> bool:
+        """
+        :param in_dir: Directory of a page with its layout manifest.
+        :param manifest: Layout manifest of the page.
+        :param fragments: Dictionary with lists of crop indices for each text part.
+        :return: True on success.
+        Crop images are renamed if they exist, the manifest always gets the new names.
+        """
+        crops = manifest['crops']
+        crop_type = manifest.get('crop_type', self.conf.image_type)
+        for frag, indices in fragments.items():
+            for i in indices:
+                crop = crops[i]
+                if frag in crop['name']:
+                    continue
+                new_name = crop['name'] + '_' + frag
+                file = join(in_dir, crop['name'] + '.' + crop_type)
+                if exists(file):
+                    try:
+                        rename(file, join(in_dir, new_name + '.' + crop_type))
+                        self.conf.catalog.rename_file(file, join(in_dir, new_name + '.' + crop_type))
+                    except:
+                        raise Exception("Could not rename layout component {0} to new name: {1}".format(file, new_name))
+                crop['name'] = new_name
+
+        return dump_layout_manifest(in_dir, manifest)
+
+    def __page_inputs(self, page_dir: str) -> list:
+        """
+        Files the text part assignment of a page depends on: its layout
+        manifest, or its crop images, if there is no manifest.
+        """
+        manifest_path = join(page_dir, layout_manifest_name)
+        if exists(manifest_path):
+            return [manifest_path]
+        return self.conf.catalog.walk_dir(page_dir, file_type=self.conf.image_type)
+
+    def __process_page(self, in_dir, cache=None) -> bool:
+        dirs = self.conf.catalog.list_sub_dirs(in_dir)
+        # Pages of other shards may not be written yet, a shard may own none.
+        if not dirs and self.conf.shard.count == 1:
             raise Exception('Directory structure does not seem to be correct.')
-        for sub_dir in dirs:
-            pages = walk_dir(dirname(sub_dir), file_type=file_type)
-            if pages:
-                pages = pages[0]
-            else:
-                raise Exception('Could not find corresponding original page for {0}'.format(sub_dir))
-            original_size = imread(pages).shape
-            fragments = self.__arrange_text(sub_dir, original_size)
-            self._rename_fragments(fragments)
+        dirs = self.conf.shard.select('chronicle', dirs, key=page_key)
+        if cache:
+            current = [sub_dir for sub_dir in dirs if not cache.outdated(cache.key(sub_dir), self.__page_inputs(sub_dir))]
+            for sub_dir in current:
+                self.conf.shard.skipped('chronicle', page_key(sub_dir))
+            dirs = [sub_dir for sub_dir in dirs if sub_dir not in current]
+
+        # The text parts of all pages of the document are assigned in one pass.
+        layouts = [self.__page_layout(sub_dir) for sub_dir in dirs]
+        fragments = self.assign_volume([widths for __, widths, __ in layouts],
+                                       [page_width for __, __, page_width in layouts])
+        for sub_dir, (layout, __, __), page_fragments in zip(dirs, layouts, fragments):
+            with self.conf.metrics.item():
+                if isinstance(layout, dict):
+                    self.__arrange_manifest(sub_dir, layout, page_fragments)
+                else:
+                    self.__arrange_text(layout, page_fragments)
+            self.conf.metrics.count('pages')
+            if cache:
+                # Renaming changes the inputs, so the state after the run is recorded.
+                cache.record(cache.key(sub_dir), cache.digest(self.__page_inputs(sub_dir)))
+            self.conf.shard.done('chronicle', page_key(sub_dir))
         return True
 
+    def __page_layout(self, sub_dir: str) -> tuple:
+        """
+        Returns the layout manifest of a page, or its crop images if there is
+        no manifest, with the widths of the crops and of the original page.
+        Sizes are taken from the manifest or from image headers, no image is decoded.
+        """
+        manifest = read_layout_manifest(sub_dir)
+        if manifest:
+            crops = manifest['crops']
+            if not crops:
+                raise Exception("No layout components in manifest of {0}".format(sub_dir))
+            return manifest, [crop['size'][1] for crop in crops], manifest['page_size'][1]
+
+        pages = self.conf.catalog.walk_dir(dirname(sub_dir), file_type=self.conf.image_type)
+        if not pages:
+            raise Exception('Could not find corresponding original page for {0}'.format(sub_dir))
+        components = self.conf.catalog.walk_dir(sub_dir, file_type=self.conf.image_type)
+        # Maybe no output by image processing, so need to be checked manually!
+        if not components:
+            raise Exception("No images found in {0}".format(sub_dir))
+        return components, [image_size(component)[1] for component in components], image_size(pages[0])[1]
+
     def __process_chronicle(self) -> bool:
         in_dir = self.conf.in_dir
-        dirs = list_sub_dirs(in_dir)
+        self.conf.catalog.scan(in_dir)
+        dirs = self.conf.catalog.list_sub_dirs(in_dir)
         if self.conf.verbose:
             print("++ Chronicle Processor ++")
             print("   Processing file(s) in path " + in_dir)
         if not dirs:
             raise Exception('Directory structure does not seem to be correct: {0}'.format(in_dir))
 
-        for sub_dir in dirs:
-            if self.conf.verbose:
-                print("    ... " + sub_dir + " ... ")
-            self.__process_page(sub_dir)
+        cache = None
+        if self.conf.incremental:
+            cache = BuildCache(in_dir, 'chronicle', {'image_type': self.conf.image_type},
+                               file_name=self.conf.shard.file_name(BuildCache.file_name))
+        try:
+            for sub_dir in dirs:
+                if self.conf.verbose:
+                    print("    ... " + sub_dir + " ... ")
+                self.__process_page(sub_dir, cache)
+        finally:
+            if cache:
+                cache.save()
 
         if self.conf.verbose:
             print("++++++++++++++++++++++")
@@ -128,6 +229,7 @@ class ChronicleProcessor:
 
     def run(self) -> None:
         try:
-            self.__process_chronicle()
+            with self.conf.metrics.stage('chronicle'):
+                self.__process_chronicle()
         except KeyboardInterrupt:
             print("\nComputation cancelled.")
@@ -1,14 +1,61 @@
 # coding=utf-8
 
 
+from math import ceil
 from os.path import dirname
 from os.path import join
 from os.path import realpath
 
+from app.catalog import Catalog
+from app.metrics import Metrics
+from app.shard import Shard
 from app.util import read_json_to_obj
 from app.util import dump_obj_to_json
 
 
+class TextBoxParams:
+    """
+    Immutable text box params of one resolution, see Config.text_box_params.
+
+    Next to the params of set_params_text_box it holds the integer thresholds
+    the detection compares against: white_run (min_white_lines), min_black_pixels
+    (density_filter) and max_log_gap (max_distance), and the 8 bit grey levels
+    black_level and white_level of black_value and white_value.
+    """
+
+    fields = ('black_value', 'white_value',
+              'min_white_lines', 'min_crop_ratio', 'max_distance', 'density_filter',
+              'correction_upper', 'correction_lower', 'correction_left', 'correction_right',
+              'vertical_margin', 'horizontal_margin')
+
+    __slots__ = fields + ('white_run', 'min_black_pixels', 'max_log_gap', 'black_level', 'white_level')
+
+    def __init__(self, params: dict):
+        for name in TextBoxParams.fields:
+            object.__setattr__(self, name, params[name])
+        object.__setattr__(self, 'vertical_margin', int(params['vertical_margin']))
+        object.__setattr__(self, 'horizontal_margin', int(params['horizontal_margin']))
+        # Counts of white rows and black pixels are integers, so comparing
+        # them with the rounded up limits gives the same results.
+        object.__setattr__(self, 'white_run', int(ceil(params['min_white_lines'])))
+        object.__setattr__(self, 'min_black_pixels', int(ceil(params['density_filter'])))
+        object.__setattr__(self, 'max_log_gap', int(ceil(params['max_distance'])))
+        # Grey level g is black, if g / 255 <= black_value, as for a page read as floats.
+        object.__setattr__(self, 'black_level',
+                           sum(1 for g in range(256) if g / 255.0 <= params['black_value']) - 1)
+        object.__setattr__(self, 'white_level',
+                           256 - sum(1 for g in range(256) if g / 255.0 >= params['white_value']))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('TextBoxParams are read-only')
+
+    def __reduce__(self):
+        return TextBoxParams, (self.as_dict(),)
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in TextBoxParams.fields}
+
+
 class Config:
     """
     Class holds all config files for the application.
@@ -45,11 +92,48 @@ class Config:
         self.config_dir = config_dir
         self.dump_conf = dump_conf
         self.verbose = False
+        # Engine for text box detection: 'numpy' (vectorized) or 'python' (reference loops).
+        self.text_box_engine = 'numpy'
+        # Pixel type of loaded pages: 'float' in [0, 1] or 'uint8' grey levels.
+        self.pixel_type = 'float'
+        # Downsampling factor of the coarse level of the pyramid engine.
+        self.pyramid_factor = 4
+        # Number of worker processes for page level parallelism.
+        self.jobs = 1
+        # Output format of pos results: 'json', 'jsonl' or 'columnar', see app.pos_store.
+        self.pos_format = 'json'
+        # Optional (first, last) page numbers to rasterize from each pdf.
+        self.page_range = None
+        # Rebuild only work items whose inputs or config changed since the last run.
+        self.incremental = False
+        # Write crop images next to the layout manifest of each page.
+        self.write_crops = True
+        # Encoding of crop images: None (image_type), 'png', 'tif' or 'npy', see app.crop_writer.
+        self.crop_format = None
+        # zlib level 0-9 of png crops, None keeps the default of io.imsave.
+        self.png_compression = None
+        # Background threads writing crops and number of crops that may wait for them.
+        self.writer_threads = 2
+        self.writer_queue_size = 64
+        # Store the crops of each document in one container file instead of one file per crop.
+        self.crop_container = False
+        # Streaming mode: size of the queues between stages and stages whose
+        # intermediate output is written to disk.
+        self.stream_queue_size = 4
+        self.stream_keep = ()
+        # Timing, memory and counters of all stages, see app.metrics.
+        self.metrics = Metrics()
+        # Listing of documents, pages and crops shared by all stages, see app.catalog.
+        self.catalog = Catalog()
+        # Part of the work items processed by this run, see app.shard.
+        self.shard = Shard()
         self.config_files = self.read_config_files()
         # NOTE: Function reference for text ox params, because they depend on cut size.
         self.params_text_box = self.set_params_text_box()
+        self.__text_box_params = {}
         self.params_text_cut = self.set_params_text_cut()
         self.params_ocr = self.set_params_ocr()
+        self.params_tagger = self.set_params_tagger()
 
         if self.dump_conf:
             dump_obj_to_json(self.config_dir,
@@ -64,6 +148,10 @@ class Config:
                              Config.config_file_names['params_ocr'],
                              self.params_ocr)
 
+            dump_obj_to_json(self.config_dir,
+                             Config.config_file_names['params_tagger'],
+                             self.params_tagger)
+
     def read_config_files(self) -> dict:
         """
         Function sets json config files.
@@ -132,6 +220,20 @@ class Config:
 
         return params
 
+    def text_box_params(self, resolution: tuple) -> TextBoxParams:
+        """
+        Returns the text box params of set_params_text_box for a resolution.
+
+        The params are built once per resolution and shared by all later calls,
+        json config overrides are applied as in set_params_text_box.
+        """
+        key = tuple(resolution[:2])
+        params = self.__text_box_params.get(key)
+        if params is None:
+            params = TextBoxParams(self.set_params_text_box(key))
+            self.__text_box_params[key] = params
+        return params
+
     def set_params_text_cut(self) -> dict:
         """
         Function sets params for text cuts after text box recognition.
@@ -159,10 +261,23 @@ class Config:
 
         params = {'tess_dir': '/opt/local/share',
                   'lan': 'fra',
-                  'page_mode': 3}
+                  'page_mode': 3,
+                  'timeout': 300}
 
         return params
 
-    # TODO
-    def set_pos_params(self):
-        pass
+    def set_params_tagger(self) -> dict:
+        """
+        Function sets params for TreeTagger pos tagging.
+
+        If json config not found, default values are used.
+        Without tagger_dir treetaggerwrapper looks for TreeTagger itself,
+        e.g. in the TAGDIR environment variable.
+        """
+        if self.config_files['params_tagger']:
+            return self.config_files['params_tagger']
+
+        params = {'tagger_dir': None,
+                  'batch_size': 200}
+
+        return params
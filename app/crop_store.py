@@ -0,0 +1,156 @@
+# coding=utf-8
+
+
+"""
+Single file container with the crops of a document.
+"""
+
+from io import BytesIO
+from os import remove
+from os import replace
+from os import sep
+from os.path import exists
+from os.path import join
+from os.path import relpath
+from threading import Lock
+from zipfile import ZIP_STORED
+from zipfile import ZipFile
+
+import numpy as np
+
+
+# File name of the crop container in each document directory.
+crop_store_name = 'crops.zip'
+
+
+def crop_entry(page_no: str, file_name: str) -> str:
+    """
+    Name of a crop in the container, e.g. '12/3.png'.
+    """
+    return page_no + '/' + file_name
+
+
+def decode_crop(data: bytes, crop_type: str) -> np.ndarray:
+    """
+    Decodes an encoded crop to 8 bit grey levels.
+    """
+    if crop_type == 'npy':
+        return np.load(BytesIO(data))
+
+    from PIL import Image
+
+    from .util import grey_uint8
+
+    return grey_uint8(np.asarray(Image.open(BytesIO(data))))
+
+
+class CropStore:
+    """
+    Reads single crops from the container of a document.
+
+    The container is an uncompressed zip file, its central directory is
+    the index of all crops: a crop is read with one seek, without
+    touching the other crops of the document.
+    """
+
+    def __init__(self, doc_dir: str, file_name=crop_store_name):
+        self.path = join(doc_dir, file_name)
+        try:
+            self.zip = ZipFile(self.path, mode='r')
+        except Exception as e:
+            raise Exception("Could not read crop container {0}: {1}".format(self.path, repr(e)))
+        self.__lock = Lock()
+
+    def entries(self) -> list:
+        return self.zip.namelist()
+
+    def read_bytes(self, entry: str) -> bytes:
+        with self.__lock:
+            return self.zip.read(entry)
+
+    def read(self, entry: str) -> np.ndarray:
+        return decode_crop(self.read_bytes(entry), entry.rsplit('.', 1)[-1])
+
+    def close(self) -> None:
+        self.zip.close()
+
+
+class CropStoreWriter:
+    """
+    Writes the crops of a document into its container.
+
+    Crops of the pages given to page() replace those of an existing
+    container, which is only replaced by close(), all other pages are
+    copied over. Crops may be added from several threads.
+    """
+
+    def __init__(self, doc_dir: str, file_name=crop_store_name):
+        self.root = doc_dir
+        self.path = join(doc_dir, file_name)
+        self.tmp_path = self.path + '.tmp'
+        self.zip = ZipFile(self.tmp_path, mode='w', compression=ZIP_STORED, allowZip64=True)
+        self.pages = set()
+        self.__lock = Lock()
+
+    def page(self, page_no: str) -> None:
+        with self.__lock:
+            self.pages.add(page_no)
+
+    def add(self, path: str, data: bytes) -> None:
+        """
+        Adds the crop of the page directory path, e.g. doc_dir/12/3.png.
+        """
+        entry = relpath(path, self.root).replace(sep, '/')
+        with self.__lock:
+            self.pages.add(entry.split('/')[0])
+            self.zip.writestr(entry, data)
+
+    def close(self) -> bool:
+        with self.__lock:
+            try:
+                if exists(self.path):
+                    with ZipFile(self.path, mode='r') as old:
+                        for info in old.infolist():
+                            if info.filename.split('/')[0] not in self.pages:
+                                self.zip.writestr(info, old.read(info))
+                self.zip.close()
+                replace(self.tmp_path, self.path)
+                return True
+            except Exception as e:
+                self.zip.close()
+                if exists(self.tmp_path):
+                    remove(self.tmp_path)
+                raise Exception("Could not write crop container {0}: {1}".format(self.path, repr(e)))
+
+
+class CropCollector:
+    """
+    Collects the crops of a worker process, to be added to the container by its parent.
+    """
+
+    def __init__(self):
+        self.pages = []
+        self.crops = []
+        self.__lock = Lock()
+
+    def __getstate__(self):
+        return {'pages': self.pages, 'crops': self.crops}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.pages = state['pages']
+        self.crops = state['crops']
+
+    def page(self, page_no: str) -> None:
+        with self.__lock:
+            self.pages.append(page_no)
+
+    def add(self, path: str, data: bytes) -> None:
+        with self.__lock:
+            self.crops.append((path, data))
+
+    def replay(self, store) -> None:
+        for page_no in self.pages:
+            store.page(page_no)
+        for path, data in self.crops:
+            store.add(path, data)
@@ -0,0 +1,138 @@
+# coding=utf-8
+
+
+"""
+Writes crop images in background threads.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from os.path import splitext
+from threading import BoundedSemaphore
+from threading import Lock
+
+import numpy as np
+
+from .util import grey_uint8
+
+
+crop_formats = ('png', 'tif', 'tiff', 'jpg', 'jpeg', 'npy')
+
+
+def write_crop(path: str, image: np.ndarray, crop_format: str, png_compression=None) -> bool:
+    """
+    Encodes a crop to path.
+
+    npy stores the 8 bit grey levels as raw NumPy array, tif an uncompressed
+    TIFF. PNG crops are compressed with png_compression (0-9), if given.
+    Otherwise, and without crop_format, crops are written by io.imsave.
+    """
+    if crop_format == 'npy':
+        np.save(path, grey_uint8(image))
+        return True
+
+    if crop_format in ('tif', 'tiff') or (crop_format == 'png' and png_compression is not None):
+        from PIL import Image
+
+        crop = Image.fromarray(grey_uint8(image))
+        if crop_format == 'png':
+            crop.save(path, format='PNG', compress_level=int(png_compression))
+        else:
+            crop.save(path, format='TIFF')
+        return True
+
+    from skimage import io
+    io.imsave(path, image)
+    return True
+
+
+def encode_crop(image: np.ndarray, crop_type: str, png_compression=None) -> bytes:
+    """
+    Encodes a crop in memory, as write_crop would write it with crop_format crop_type.
+    """
+    buffer = BytesIO()
+    if crop_type == 'npy':
+        np.save(buffer, grey_uint8(image))
+        return buffer.getvalue()
+
+    from PIL import Image
+
+    crop = Image.fromarray(grey_uint8(image))
+    if crop_type == 'png':
+        crop.save(buffer, format='PNG', compress_level=6 if png_compression is None else int(png_compression))
+    elif crop_type in ('tif', 'tiff'):
+        crop.save(buffer, format='TIFF')
+    elif crop_type in ('jpg', 'jpeg'):
+        crop.save(buffer, format='JPEG')
+    else:
+        raise Exception('Unknown crop format: {0}'.format(crop_type))
+    return buffer.getvalue()
+
+
+class CropWriter:
+    """
+    Writes crops through a pool of threads, so that the analysis of the next
+    page overlaps the encoding and writing of the crops of the current one.
+
+    At most queue_size crops wait for writing, write() blocks on a full queue.
+    With threads set to 0 every crop is written right away.
+    Failed writes are logged and reported by flush().
+
+    Crops given with a store are encoded in memory and added to the store
+    (see app.crop_store) under their path, instead of being written to it.
+    """
+
+    def __init__(self, threads: int, queue_size: int, crop_format=None, png_compression=None):
+        if crop_format is not None and crop_format not in crop_formats:
+            raise Exception('Unknown crop format: {0}'.format(crop_format))
+        self.crop_format = crop_format
+        self.png_compression = png_compression
+        self.executor = ThreadPoolExecutor(max_workers=threads) if threads > 0 else None
+        self.queue_size = max(1, queue_size)
+        self.slots = BoundedSemaphore(self.queue_size)
+        self.pending = []
+        self.failed = []
+        self.__lock = Lock()
+
+    def __write(self, path: str, image: np.ndarray, store=None) -> bool:
+        try:
+            if store is not None:
+                crop_type = splitext(path)[1][1:]
+                store.add(path, encode_crop(image, crop_type, self.png_compression))
+                return True
+            return write_crop(path, image, self.crop_format, self.png_compression)
+        except Exception as e:
+            logging.error("Could not write crop {0}: {1}".format(path, repr(e)))
+            with self.__lock:
+                self.failed.append(path)
+            return False
+
+    def write(self, path: str, image: np.ndarray, store=None) -> None:
+        if self.executor is None:
+            self.__write(path, image, store)
+            return
+        self.slots.acquire()
+        future = self.executor.submit(self.__write, path, image, store)
+        future.add_done_callback(lambda f: self.slots.release())
+        self.pending.append(future)
+        if len(self.pending) > 2 * self.queue_size:
+            self.pending = [f for f in self.pending if not f.done()]
+
+    def flush(self) -> list:
+        """
+        Waits for all pending crops.
+        Returns the paths of the crops that could not be written since the last flush.
+        """
+        pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+        with self.__lock:
+            failed, self.failed = self.failed, []
+        return failed
+
+    def close(self) -> list:
+        failed = self.flush()
+        if self.executor is not None:
+            self.executor.shutdown()
+        return failed
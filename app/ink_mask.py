@@ -0,0 +1,94 @@
+# coding=utf-8
+
+
+"""
+Bit-packed ink mask of a page.
+"""
+
+import numpy as np
+
+
+# Number of set bits of every byte value.
+_popcount = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def pool_rows(mask: np.ndarray, factor: int) -> np.ndarray:
+    """
+    ORs every factor consecutive rows of a boolean or bit-packed mask into one row.
+    """
+    pooled = np.zeros((-(-mask.shape[0] // factor), mask.shape[1]), dtype=mask.dtype)
+    for offset in range(factor):
+        part = mask[offset::factor]
+        pooled[:part.shape[0]] |= part
+    return pooled
+
+
+def pool_columns(mask: np.ndarray, factor: int) -> np.ndarray:
+    """
+    ORs every factor consecutive columns of a boolean mask into one column.
+    """
+    pooled = np.zeros((mask.shape[0], -(-mask.shape[1] // factor)), dtype=mask.dtype)
+    for offset in range(factor):
+        part = mask[:, offset::factor]
+        pooled[:, :part.shape[1]] |= part
+    return pooled
+
+
+class InkMask:
+    """
+    Black pixels of a page, thresholded once and packed to 8 pixels per byte.
+
+    Rows are packed along the columns, like np.packbits(ink, axis=1).
+    Ink counts of rows come from popcounts of the packed bytes, pixels are
+    unpacked only for the rows and columns a caller asks for.
+    """
+
+    def __init__(self, ink: np.ndarray):
+        self.height, self.width = ink.shape
+        self.bits = np.packbits(ink, axis=1)
+
+    @property
+    def shape(self) -> tuple:
+        return self.height, self.width
+
+    def unpack(self, top: int, bottom: int, left: int, right: int) -> np.ndarray:
+        """
+        Boolean mask of the region [top:bottom, left:right].
+        """
+        return self.unpack_rows(slice(top, bottom), left, right)
+
+    def unpack_rows(self, rows, left: int, right: int) -> np.ndarray:
+        """
+        Boolean mask of the columns [left:right] of rows, a slice or an array of row numbers.
+        """
+        right = max(left, right)
+        first, last = left // 8, -(-right // 8)
+        pixels = np.unpackbits(self.bits[rows, first:last], axis=1)
+        return pixels[:, left - first * 8:right - first * 8].view(bool)
+
+    def row_counts(self, top: int, bottom: int, left: int, right: int) -> np.ndarray:
+        """
+        Number of black pixels in the columns [left:right] of every row [top:bottom].
+        """
+        if right <= left:
+            return np.zeros(max(0, bottom - top), dtype=np.int64)
+        first, last = left // 8, -(-right // 8)
+        chunk = self.bits[top:bottom, first:last]
+        counts = _popcount[chunk].sum(axis=1, dtype=np.int64)
+        # Drop the bits of the partial bytes outside of [left:right].
+        head, tail = left - first * 8, last * 8 - right
+        if head:
+            counts -= _popcount[chunk[:, 0] & ((0xFF << (8 - head)) & 0xFF)]
+        if tail:
+            counts -= _popcount[chunk[:, -1] & ((1 << tail) - 1)]
+        return counts
+
+    def block_any(self, top: int, bottom: int, left: int, right: int, factor: int) -> np.ndarray:
+        """
+        Region [top:bottom, left:right] downsampled by factor,
+        a block is set if any of its pixels is black.
+        """
+        pooled = pool_rows(self.bits[top:bottom], factor)
+        first = left // 8
+        pixels = np.unpackbits(pooled[:, first:-(-right // 8)], axis=1)
+        return pool_columns(pixels[:, left - first * 8:right - first * 8].view(bool), factor)
@@ -6,90 +6,197 @@ Module provides optical text box recognition in image files.
 """
 
 import logging
+from functools import lru_cache
 from os.path import basename
+from os.path import dirname
 from os.path import exists
 from os.path import join
 
 import numpy as np
-from skimage import io
 
+from .build_cache import BuildCache
+from .crop_store import CropCollector
+from .crop_store import CropStoreWriter
+from .crop_store import crop_entry
+from .crop_store import crop_store_name
+from .crop_writer import CropWriter
+from .crop_writer import crop_formats
+from .ink_mask import InkMask
+from .shard import page_key
 from .util import clear_dir
-from .util import list_sub_dirs
-from .util import walk_dir
+from .util import dump_layout_manifest
+from .util import layout_manifest_name
+from .util import read_layout_manifest
+from .util import read_page
 
 from app.config import Config
+from app.config import TextBoxParams
+
+
+@lru_cache(maxsize=32)
+def _log_table(size: int) -> np.ndarray:
+    """
+    Lookup table of math.log for all pixel distances within a row.
+    """
+    from math import log
+    return np.array([0.0] + [log(distance) for distance in range(1, max(size, 1))])
 
 
 class ImageProcessor:
     def __init__(self, conf):
         if not isinstance(conf, Config) or not conf:
             raise TypeError('Need instance of Config class!')
+        if conf.text_box_engine not in ('python', 'numpy', 'pyramid'):
+            raise Exception('Unknown text box engine: {0}'.format(conf.text_box_engine))
+        if conf.pixel_type not in ('float', 'uint8'):
+            raise Exception('Unknown pixel type: {0}'.format(conf.pixel_type))
         self.conf = conf
+        self.__writer = None
+        self.__stores = {}
+
+    def __crop_writer(self) -> CropWriter:
+        if self.__writer is None:
+            # Without conf.crop_format crops are written as image_type, png_compression applies to those too.
+            crop_format = self.conf.crop_format or self.conf.image_type
+            self.__writer = CropWriter(self.conf.writer_threads, self.conf.writer_queue_size,
+                                       crop_format if crop_format in crop_formats else None,
+                                       self.conf.png_compression)
+        return self.__writer
+
+    def __crop_store(self, doc_dir: str):
+        if doc_dir not in self.__stores:
+            self.__stores[doc_dir] = CropStoreWriter(doc_dir, self.conf.shard.file_name(crop_store_name))
+        return self.__stores[doc_dir]
+
+    def _collect_crops(self, doc_dir: str) -> CropCollector:
+        """
+        Collects the crops of doc_dir instead of writing its container, for worker processes.
+        """
+        self.__stores[doc_dir] = CropCollector()
+        return self.__stores[doc_dir]
 
-    def __detect_text_boxes(self, image: np.ndarray, vertical=False) -> list:
-        from math import floor
-        from skimage.transform import rotate
-        if image.ndim > 2 or 0 in image.shape:
+    def flush_crops(self) -> list:
+        """
+        Waits until all crops are written and closes the crop containers.
+        Returns the paths of crops that could not be written.
+        """
+        failed = self.__writer.flush() if self.__writer is not None else []
+        stores, self.__stores = self.__stores, {}
+        for doc_dir, store in stores.items():
+            if not isinstance(store, CropStoreWriter):
+                continue
+            try:
+                store.close()
+                self.conf.catalog.add_file(store.path)
+            except Exception as e:
+                logging.error(e)
+                failed.extend(join(doc_dir, page_no, '') for page_no in store.pages)
+        return failed
+
+    def close_crops(self) -> list:
+        """
+        Like flush_crops, and stops the threads of the crop writer. A following crop starts a new writer.
+        """
+        failed = self.flush_crops()
+        self.__close_writer()
+        return failed
+
+    def __close_writer(self) -> None:
+        if self.__writer is not None:
+            self.__writer.close()
+            self.__writer = None
+
+    def __ink_mask(self, image: np.ndarray) -> InkMask:
+        """
+        Thresholds a page once into a bit-packed mask of black pixels.
+        8 bit pages are compared with the grey level of black_value in uint8 mode.
+        """
+        params = self.conf.text_box_params(image.shape)
+        if self.conf.pixel_type == 'uint8' and image.dtype == np.uint8:
+            return InkMask(image <= params.black_level)
+        return InkMask(image <= params.black_value)
+
+    def __detect_text_boxes(self, mask: InkMask, top: int, bottom: int, vertical=False) -> list:
+        """
+        Returns the cut positions of the rows [top:bottom] of a page ink mask.
+        Vertical cut positions are columns of the page.
+        """
+        if bottom <= top or not mask.width:
             return []
 
-        params = self.conf.set_params_text_box(image.shape)
+        params = self.conf.text_box_params((bottom - top, mask.width))
 
-        dim1, dim2 = image.shape
+        dim1, dim2 = bottom - top, mask.width
 
-        if vertical and max(dim1, dim2) / min(dim1, dim2) > params['min_crop_ratio']:
+        if vertical and max(dim1, dim2) / min(dim1, dim2) > params.min_crop_ratio:
             return []
 
-        if vertical:
-            image_copy = rotate(image, 270, resize=True)
-        else:
-            image_copy = image
+        if self.conf.text_box_engine == 'python':
+            image = mask.unpack(top, bottom, 0, mask.width)
+            if vertical:
+                # Zero-copy view of the image rotated by 90 degrees clockwise:
+                # rows of the view are the columns of the image, so the cut
+                # positions are column positions of the image without remapping.
+                image_copy = image.T[:, ::-1]
+            else:
+                image_copy = image
+            return self.__scan_rows_python(image_copy, params, vertical)
+        if self.conf.text_box_engine == 'pyramid':
+            return self.__scan_rows_pyramid(mask, top, bottom, params, vertical)
+        return self.__scan_rows_numpy(mask, top, bottom, params, vertical)
+
+    def __scan_rows_python(self, image_copy: np.ndarray, params: TextBoxParams, vertical: bool) -> list:
+        """
+        Reference engine: scans every pixel of every row in Python loops.
+        """
+        from math import floor
 
         dim1, dim2 = image_copy.shape
-        
+
         state_in, state_out = False, True
 
         curr_white_lines = 0
 
         cut_positions = []
 
-        for row in range(params['vertical_margin'], dim1 - params['vertical_margin']):
+        for row in range(params.vertical_margin, dim1 - params.vertical_margin):
             black_pixels_read = []
-            for col in range(params['horizontal_margin'], dim2 - params['horizontal_margin']):
+            for col in range(params.horizontal_margin, dim2 - params.horizontal_margin):
                 if state_in:
-                    if image_copy[row, col] <= params['black_value']:
+                    if image_copy[row, col]:
                         black_pixels_read.append(col)
 
-                    if col == (dim2 - params['horizontal_margin'] - 1):
+                    if col == (dim2 - params.horizontal_margin - 1):
 
                         if self.__black_pixels_are_dense(black_pixels_read,
-                                                         params['max_distance'],
-                                                         params['density_filter']):
+                                                         params.max_log_gap,
+                                                         params.min_black_pixels):
                             curr_white_lines = 0
                         else:
                             curr_white_lines += 1
 
-                        if curr_white_lines >= params['min_white_lines']:
+                        if curr_white_lines >= params.white_run:
                             curr_white_lines = 0
                             state_out, state_in = True, False
                             entry_p = cut_positions[-1][0]
                             exit_p = row
                             if vertical:
-                                cut_positions[-1] = (floor(entry_p + params['correction_left']),
-                                                     floor(exit_p + params['correction_right']))
+                                cut_positions[-1] = (floor(entry_p + params.correction_left),
+                                                     floor(exit_p + params.correction_right))
                             else:
-                                cut_positions[-1] = (floor(entry_p + params['correction_upper']),
-                                                     floor(exit_p + params['correction_lower']))
+                                cut_positions[-1] = (floor(entry_p + params.correction_upper),
+                                                     floor(exit_p + params.correction_lower))
                             break
                         else:
                             continue
 
                 elif state_out:
-                    if image_copy[row, col] <= params['black_value']:
+                    if image_copy[row, col]:
                         black_pixels_read.append(col)
-                    if col == (dim2 - params['horizontal_margin'] - 1):
+                    if col == (dim2 - params.horizontal_margin - 1):
                         if self.__black_pixels_are_dense(black_pixels_read,
-                                                         params['max_distance'],
-                                                         params['density_filter']):
+                                                         params.max_log_gap,
+                                                         params.min_black_pixels):
                             state_in, state_out = True, False
                             entry_point = row
                             cut_positions.append((entry_point, None))
@@ -98,6 +205,213 @@ class ImageProcessor:
 
         return cut_positions
 
+    @staticmethod
+    def __view_region(mask: InkMask, top: int, bottom: int, params: TextBoxParams, vertical: bool) -> tuple:
+        """
+        Returns the region of the rows [top:bottom] inside the margins as
+        (first_row, last_row, first_col, last_col) of the page.
+
+        The scan runs over the rows of a horizontal region and over the
+        columns of a vertical one, whose margins are swapped accordingly.
+        """
+        if vertical:
+            return (top + params.horizontal_margin, bottom - params.horizontal_margin,
+                    params.vertical_margin, mask.width - params.vertical_margin)
+        return (top + params.vertical_margin, bottom - params.vertical_margin,
+                params.horizontal_margin, mask.width - params.horizontal_margin)
+
+    def __dense_view_rows(self, mask: InkMask, region: tuple, params: TextBoxParams, vertical: bool,
+                          start: int, stop: int) -> np.ndarray:
+        """
+        Evaluates the scan rows [start:stop] of a region, see __dense_rows.
+
+        Rows with too few black pixels are rejected by their ink count,
+        only the others are unpacked to measure the gaps between their pixels.
+        """
+        first_row, last_row, first_col, last_col = region
+        if vertical:
+            # Scan rows are page columns, the scan runs from the bottom of the strip upwards.
+            block = mask.unpack(first_row, last_row, first_col + start, first_col + stop)
+            counts = np.count_nonzero(block, axis=0)
+        else:
+            block = None
+            counts = mask.row_counts(first_row + start, first_row + stop, first_col, last_col)
+
+        dense = np.zeros(counts.size, dtype=bool)
+        candidates = np.flatnonzero((counts > 0) & (counts >= params.min_black_pixels))
+        if not candidates.size:
+            return dense
+
+        if vertical:
+            rows = block.T[candidates, ::-1]
+        else:
+            rows = mask.unpack_rows(first_row + start + candidates, first_col, last_col)
+        dense[candidates] = self.__dense_rows(rows, params.max_log_gap, params.min_black_pixels)
+        return dense
+
+    def __scan_rows_numpy(self, mask: InkMask, top: int, bottom: int, params: TextBoxParams, vertical: bool) -> list:
+        """
+        Vectorized engine: same cut positions as __scan_rows_python,
+        but every row is measured and tracked as a whole array.
+        """
+        from math import floor
+
+        region = self.__view_region(mask, top, bottom, params, vertical)
+        first_row, last_row, first_col, last_col = region
+        if last_row <= first_row or last_col <= first_col:
+            return []
+        n_rows = (last_col - first_col) if vertical else (last_row - first_row)
+
+        dense = self.__dense_view_rows(mask, region, params, vertical, 0, n_rows)
+
+        if vertical:
+            correction_in, correction_out = params.correction_left, params.correction_right
+        else:
+            correction_in, correction_out = params.correction_upper, params.correction_lower
+
+        return [(floor(entry_p + params.vertical_margin + correction_in),
+                 floor(exit_p + params.vertical_margin + correction_out))
+                for entry_p, exit_p in self.__track_text_rows(dense, params.white_run)]
+
+    def __scan_rows_pyramid(self, mask: InkMask, top: int, bottom: int, params: TextBoxParams, vertical: bool) -> list:
+        """
+        Coarse-to-fine engine: finds text rows on the ink mask downsampled by
+        conf.pyramid_factor, then evaluates full resolution rows only in narrow
+        bands around the boundaries of every coarse text box.
+
+        Pixel thresholds are divided by the factor for the coarse level, white
+        runs are shortened so that no gap of the full resolution is lost.
+        Margins and corrections are applied in full resolution only.
+        On clean pages the cuts are those of the numpy engine. Heavy speckle
+        noise can make coarse rows dense and bridge white gaps, which merges boxes.
+        """
+        from math import floor
+
+        factor = self.conf.pyramid_factor
+        if factor < 2 or params.white_run <= 0 or min(bottom - top, mask.width) < 32 * factor:
+            return self.__scan_rows_numpy(mask, top, bottom, params, vertical)
+
+        region = self.__view_region(mask, top, bottom, params, vertical)
+        first_row, last_row, first_col, last_col = region
+        if last_row <= first_row or last_col <= first_col:
+            return []
+        n_rows = (last_col - first_col) if vertical else (last_row - first_row)
+
+        def dense_band(start: int, stop: int) -> np.ndarray:
+            start, stop = max(0, start), min(n_rows, stop)
+            if start >= stop:
+                return np.zeros(0, dtype=int)
+            return start + np.flatnonzero(self.__dense_view_rows(mask, region, params, vertical, start, stop))
+
+        coarse = mask.block_any(first_row, last_row, first_col, last_col, factor)
+        if vertical:
+            coarse = coarse.T[:, ::-1]
+
+        # A white gap of white_run rows keeps at least white_run // factor - 1 white blocks.
+        coarse_run = max(1, params.white_run // factor - 1)
+        coarse_dense = self.__dense_rows(coarse,
+                                         params.max_log_gap,
+                                         -(-params.min_black_pixels // factor))
+
+        spans = []
+        for first_c, last_c in self.__text_spans(np.flatnonzero(coarse_dense), coarse_run):
+            head = dense_band((first_c - 1) * factor, (first_c + 2) * factor)
+            tail = dense_band((last_c - 1) * factor, (last_c + 2) * factor)
+            if head.size and tail.size and head[0] <= tail[-1]:
+                spans.append((int(head[0]), int(tail[-1])))
+            else:
+                # No text rows at the coarse boundaries, check the whole box.
+                spans.extend(self.__text_spans(dense_band((first_c - 1) * factor, (last_c + 2) * factor),
+                                               params.white_run))
+
+        # Coarse boxes split by shorter gaps than white_run are one box in full resolution.
+        merged = []
+        for first, last in sorted(spans):
+            if merged and first - merged[-1][1] - 1 < params.white_run:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+            else:
+                merged.append((first, last))
+
+        boxes = [(first, last + params.white_run) for first, last in merged]
+        # The last box stays open, if the image ends before enough white rows.
+        if boxes and boxes[-1][1] >= n_rows:
+            boxes.pop()
+
+        if vertical:
+            correction_in, correction_out = params.correction_left, params.correction_right
+        else:
+            correction_in, correction_out = params.correction_upper, params.correction_lower
+
+        return [(floor(entry_p + params.vertical_margin + correction_in),
+                 floor(exit_p + params.vertical_margin + correction_out))
+                for entry_p, exit_p in boxes]
+
+    @staticmethod
+    def __text_spans(dense_rows: np.ndarray, white_run: int) -> list:
+        """
+        Groups sorted dense row numbers into (first, last) spans separated by at least white_run white rows.
+        """
+        if not dense_rows.size:
+            return []
+        breaks = np.flatnonzero(np.diff(dense_rows) - 1 >= white_run)
+        firsts = np.concatenate((dense_rows[:1], dense_rows[breaks + 1]))
+        lasts = np.concatenate((dense_rows[breaks], dense_rows[-1:]))
+        return list(zip(firsts.tolist(), lasts.tolist()))
+
+    @staticmethod
+    def __dense_rows(ink: np.ndarray, max_log_gap: int, min_black_pixels: int) -> np.ndarray:
+        """
+        Evaluates __black_pixels_are_dense for every row of a boolean ink mask at once.
+
+        Log-gaps are summed per row in the same order as the reference engine,
+        so the averages are bit-identical.
+        """
+        n_rows, n_cols = ink.shape
+        counts = np.count_nonzero(ink, axis=1)
+
+        # Mirrored columns: consecutive hits run from the rightmost pixel leftwards.
+        rows, cols = np.nonzero(ink[:, ::-1])
+        same_row = rows[1:] == rows[:-1]
+        gaps = (cols[1:] - cols[:-1])[same_row]
+        log_sums = np.bincount(rows[1:][same_row],
+                               weights=_log_table(n_cols)[gaps],
+                               minlength=n_rows)
+
+        average = np.zeros(n_rows)
+        np.divide(log_sums, counts, out=average, where=counts > 0)
+
+        return (counts > 0) & (counts >= min_black_pixels) & (np.floor(average) <= max_log_gap)
+
+    @staticmethod
+    def __track_text_rows(dense: np.ndarray, white_run: int) -> list:
+        """
+        Runs the in/out state machine over a vector of dense rows.
+
+        Returns (entry, exit) row pairs for all text boxes that were closed
+        by at least white_run white rows.
+        """
+        dense_rows = np.flatnonzero(dense)
+        if not dense_rows.size:
+            return []
+
+        if white_run <= 0:
+            # Every box is closed on the row right after its entry.
+            boxes = []
+            next_free = 0
+            for row in dense_rows.tolist():
+                if row >= next_free and row + 1 < dense.size:
+                    boxes.append((row, row + 1))
+                    next_free = row + 2
+            return boxes
+
+        boxes = [(first, last + white_run) for first, last in ImageProcessor.__text_spans(dense_rows, white_run)]
+
+        # The last box stays open, if the image ends before enough white rows.
+        if boxes[-1][1] >= dense.size:
+            boxes.pop()
+
+        return boxes
+
     @staticmethod
     def __black_pixels_are_dense(black_pixels: list, max_distance: float, density_filter: int):
         from math import log
@@ -123,19 +437,34 @@ class ImageProcessor:
             return False
 
     def __cut_text_from_image(self, image: np.ndarray) -> list:
+        return [image[top:bottom, left:right] for top, bottom, left, right in self.__cut_text_boxes(image)]
+
+    def __cut_text_boxes(self, image: np.ndarray) -> list:
+        """
+        Returns the text boxes of an image as (top, bottom, left, right) tuples
+        of page coordinates, so that image[top:bottom, left:right] is the box.
+        """
         params = self.conf.params_text_cut
 
-        text_images = []
+        height, width = image.shape[:2]
+
+        text_boxes = []
+
+        # If not a grey scale image, leave image as it is.
+        if image.ndim != 2:
+            return [(0, height, 0, width)]
 
-        horizontal_cuts = self.__detect_text_boxes(image)
+        ink = self.__ink_mask(image)
+
+        horizontal_cuts = self.__detect_text_boxes(ink, 0, height)
 
         # If not boxes detected, leave image as it is.
         if not horizontal_cuts:
-            return [image]
+            return [(0, height, 0, width)]
 
         # If too many cuts detected, leave image as it is.
         if len(horizontal_cuts) > params['max_no_of_hor_cuts']:
-            return [image]
+            return [(0, height, 0, width)]
 
         # If any reasonable cuts detected, crop image.
         for hor_cut in horizontal_cuts:
@@ -149,19 +478,20 @@ class ImageProcessor:
             if abs(x_out - x_in) < image.shape[0] * params['filter_small_hor']:
                 continue
 
-            # Cut image.
-            horizontal_image = image[x_in:x_out][:]
+            # Cut image, resolve the slice to page coordinates.
+            top, bottom, __ = slice(x_in, x_out).indices(height)
+            bottom = max(top, bottom)
             # Now see, if any vertical cuts can be made.
-            vertical_cuts = self.__detect_text_boxes(horizontal_image, vertical=True)
+            vertical_cuts = self.__detect_text_boxes(ink, top, bottom, vertical=True)
 
             # If no vertical cuts detected, use horizontal cuts.
             if not vertical_cuts:
-                text_images.append(horizontal_image)
+                text_boxes.append((top, bottom, 0, width))
                 continue
 
             # If too many cuts detected, don't do anything.
             if len(vertical_cuts) > params['max_no_of_ver_cuts']:
-                text_images.append(horizontal_image)
+                text_boxes.append((top, bottom, 0, width))
                 continue
 
             # Process vertical cuts.
@@ -176,13 +506,14 @@ class ImageProcessor:
                     # text_images.append(horizontal_image)
                     break
 
-                vertical_image = horizontal_image[:, y_in:y_out]
+                left, right, __ = slice(y_in, y_out).indices(width)
+                right = max(left, right)
 
-                text_images.append(vertical_image)
+                text_boxes.append((top, bottom, left, right))
 
-        return text_images
+        return text_boxes
 
-    def __save_text_box(self, image: np.ndarray, out_dir: str, file_name: str) -> bool:
+    def __save_text_box(self, image: np.ndarray, out_dir: str, file_name: str, store=None) -> bool:
         # If not enough axes or empty slice, break.
         if (image.ndim < 2) or (0 in image.shape):
             return False
@@ -191,36 +522,90 @@ class ImageProcessor:
         if not out_dir.endswith('/'):
             out_dir += '/'
         path = join(out_dir, file_name)
-        try:
-            io.imsave(path, image)
-            return True
-        except IOError as e:
-            logging.error(e)
-            return False
+        # Written in the background, errors are reported by flush_crops.
+        self.__crop_writer().write(path, image, store)
+        if store is None:
+            self.conf.catalog.add_file(path)
+        return True
 
     def __process_image(self, image: np.ndarray, out_dir: str, page_no: str, image_type: str) -> bool:
+        return self.save_page(image, self.text_boxes(image), out_dir, page_no, image_type)
+
+    def text_boxes(self, image: np.ndarray) -> list:
+        """
+        Returns the text boxes of a grey scale page image as (top, bottom, left, right) tuples.
+        """
+        return self.__cut_text_boxes(image)
+
+    def cut_page(self, image: np.ndarray) -> list:
+        """
+        Returns the text boxes of a grey scale page image as list of image slices.
+        """
+        return self.__cut_text_from_image(image)
+
+    def save_page(self, image: np.ndarray, boxes: list, out_dir: str, page_no: str, image_type: str,
+                  names=None) -> bool:
+        """
+        Saves the text boxes of a page to the subdirectory page_no of out_dir.
+
+        Next to the crops a layout manifest with position, order and size of every
+        crop in the page is written. If conf.write_crops is False, only the manifest
+        is written. Text boxes are numbered from 1, unless names for the files are given.
+        Crops are written as conf.crop_format, or as image_type by default.
+        With conf.crop_container they go to the container of out_dir, see app.crop_store.
+        """
         from os import mkdir
 
         path = join(out_dir, page_no)
+        crop_type = self.conf.crop_format or image_type
+        store = None
+        if self.conf.write_crops and self.conf.crop_container:
+            store = self.__crop_store(out_dir)
+            store.page(page_no)
 
-        if exists(path) and walk_dir(path, file_type="." + image_type):
-            clear_dir(path, del_sudirs=True, file_ext="." + image_type)
+        if exists(path):
+            clear_dir(path, del_sudirs=True, file_ext=list({"." + image_type, "." + crop_type}))
 
         dir_name = join(out_dir, page_no)
         try:
             mkdir(dir_name)
+            self.conf.catalog.add_dir(dir_name, empty=True)
         except OSError as e:
             if not exists(join(out_dir, page_no)):
                 raise Exception("Could not create out_dir with page_no: {0}, {1}".format(join(out_dir, page_no), repr(e)))
-
-        file_name = 1
-
-        for text_image in self.__cut_text_from_image(image):
-            fname = str(file_name) + '.' + image_type
-            self.__save_text_box(text_image, path, fname)
-            file_name += 1
-
-        return True
+            # Crops of an earlier run were removed, the page directory is listed again.
+            self.conf.catalog.add_dir(dir_name)
+
+        if not names:
+            names = [str(file_name) for file_name in range(1, len(boxes) + 1)]
+
+        crops = []
+        for box, name in zip(boxes, names):
+            top, bottom, left, right = box
+            text_image = image[top:bottom, left:right]
+            # Empty slices are never saved, but keep their number.
+            if (text_image.ndim < 2) or (0 in text_image.shape):
+                continue
+            if self.conf.write_crops:
+                self.__save_text_box(text_image, path, name + '.' + crop_type, store)
+            crop = {'name': name,
+                    'box': [top, bottom, left, right],
+                    'size': [bottom - top, right - left]}
+            if store is not None:
+                # Renaming a crop changes its name only, it keeps its entry in the container.
+                crop['entry'] = crop_entry(page_no, name + '.' + crop_type)
+            crops.append(crop)
+        self.conf.metrics.count('crops', len(crops))
+
+        manifest = {'page': page_no + '.' + image_type,
+                    'page_size': list(image.shape[:2]),
+                    'crop_type': crop_type,
+                    'crops': crops}
+        if store is not None:
+            manifest['container'] = self.conf.shard.file_name(crop_store_name)
+
+        self.conf.catalog.add_file(join(path, layout_manifest_name))
+        return dump_layout_manifest(path, manifest)
 
     def __process_image_stack(self) -> bool:
         """
@@ -250,7 +635,9 @@ class ImageProcessor:
         in_dir = self.conf.in_dir
         image_type = self.conf.image_type
 
-        dirs = list_sub_dirs(in_dir)
+        catalog = self.conf.catalog
+        catalog.scan(in_dir, depth=1)
+        dirs = catalog.list_sub_dirs(in_dir)
 
         if self.conf.verbose:
             print("++ Layout Processor ++")
@@ -259,25 +646,156 @@ class ImageProcessor:
         if not dirs:
             raise Exception('Path tree seems to invalid in: {0}. Path has different structure'.format(in_dir))
 
+        pages = []
         for d in dirs:
-            image_files = walk_dir(d, image_type)
+            image_files = catalog.walk_dir(d, image_type)
             if not image_files:
                 continue
-
-            for image_path in image_files:
-                if self.conf.verbose:
-                    print("    ... " + image_path + " ... ")
-                image = io.imread(image_path, as_grey=True)
+            pages.extend((image_path, d) for image_path in image_files)
+        pages = self.conf.shard.select('image', pages, key=lambda page: page_key(page[0]))
+
+        cache = None
+        digests = {}
+        if self.conf.incremental:
+            cache = BuildCache(in_dir, 'image', {'params_text_box': self.conf.params_text_box,
+                                                 'params_text_cut': self.conf.params_text_cut,
+                                                 'pixel_type': self.conf.pixel_type,
+                                                 'text_box_engine': self.conf.text_box_engine,
+                                                 'pyramid_factor': self.conf.pyramid_factor
+                                                 if self.conf.text_box_engine == 'pyramid' else None,
+                                                 'write_crops': self.conf.write_crops,
+                                                 'crop_format': self.conf.crop_format,
+                                                 'crop_container': self.conf.crop_container,
+                                                 'png_compression': self.conf.png_compression,
+                                                 'image_type': image_type},
+                               file_name=self.conf.shard.file_name(BuildCache.file_name))
+            for image_path, d in pages:
                 page_no = str(basename(image_path).split('.')[0])
-                self.__process_image(image, d, page_no, image_type)
+                outputs = [join(d, page_no, layout_manifest_name)]
+                if self.conf.write_crops and self.conf.crop_container:
+                    outputs.append(join(d, self.conf.shard.file_name(crop_store_name)))
+                elif self.conf.write_crops:
+                    # The crop files of the last run, with the names the chronicle stage may have given them.
+                    manifest = read_layout_manifest(join(d, page_no))
+                    if manifest:
+                        outputs.extend(join(d, page_no, crop['name'] + '.' + manifest.get('crop_type', image_type))
+                                       for crop in manifest['crops'])
+                digest = cache.outdated(cache.key(image_path), [image_path], outputs)
+                if digest:
+                    digests[image_path] = digest
+                else:
+                    self.conf.shard.skipped('image', page_key(image_path))
+            pages = [(image_path, d) for image_path, d in pages if image_path in digests]
+
+        done = []
+        try:
+            if self.conf.jobs > 1:
+                self.__process_pages_parallel(pages, done)
+            else:
+                for image_path, d in pages:
+                    if self.conf.verbose:
+                        print("    ... " + image_path + " ... ")
+                    self._process_page_file(image_path, d)
+                    done.append(image_path)
+        finally:
+            # Pages count as done only once all their crops are written.
+            failed_dirs = {dirname(path) for path in self.flush_crops()}
+            done[:] = [image_path for image_path in done
+                       if join(dirname(image_path), basename(image_path).split('.')[0]) not in failed_dirs]
+            for image_path in done:
+                self.conf.shard.done('image', page_key(image_path))
+            if cache:
+                for image_path in done:
+                    cache.record(cache.key(image_path), digests[image_path])
+                cache.save()
         if self.conf.verbose:
             print("++++++++++++++++++++++")
 
         return True
 
+    def __process_pages_parallel(self, pages: list, done: list) -> bool:
+        """
+        Spreads pages across a pool of conf.jobs worker processes.
+        Successfully processed pages are appended to done.
+
+        Every page writes to its own directory, so the output is the same as
+        in a sequential run. A failing page is reported and does not stop the
+        other workers.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        from concurrent.futures import as_completed
+
+        failed = []
+        with ProcessPoolExecutor(max_workers=self.conf.jobs) as executor:
+            futures = {executor.submit(_process_page_worker, self.conf, image_path, d): (image_path, d)
+                       for image_path, d in pages}
+            for future in as_completed(futures):
+                image_path, d = futures[future]
+                try:
+                    metrics, crops = future.result()
+                    self.conf.metrics.merge(metrics)
+                    if crops is not None:
+                        crops.replay(self.__crop_store(d))
+                    # The page directory was written by the worker.
+                    self.conf.catalog.add_dir(join(d, str(basename(image_path).split('.')[0])))
+                except Exception as e:
+                    failed.append(image_path)
+                    self.conf.metrics.count('errors')
+                    logging.error("Could not process page {0}: {1}".format(image_path, repr(e)))
+                    continue
+                done.append(image_path)
+                if self.conf.verbose:
+                    print("    ... " + image_path + " ... ")
+
+        if failed:
+            print("   {0} of {1} page(s) failed.".format(len(failed), len(pages)))
+
+        return not failed
+
+    def _process_page_file(self, image_path: str, out_dir: str) -> bool:
+        """
+        Reads one page image and saves its text boxes to a subdirectory of out_dir.
+        """
+        with self.conf.metrics.item():
+            image = read_page(image_path, self.conf.pixel_type)
+            page_no = str(basename(image_path).split('.')[0])
+            result = self.__process_image(image, out_dir, page_no, self.conf.image_type)
+        self.conf.metrics.count('pages')
+        return result
+
     def run(self) -> None:
         try:
-            self.__process_image_stack()
+            with self.conf.metrics.stage('image'):
+                self.__process_image_stack()
         except KeyboardInterrupt:
             print("\nComputation cancelled.")
-
+        finally:
+            self.__close_writer()
+
+
+# ImageProcessor of a worker process, started on its first page and kept with
+# its crop writer threads until the pool shuts down.
+_worker_processor = None
+
+
+def _process_page_worker(conf: Config, image_path: str, out_dir: str) -> tuple:
+    """
+    Entry point for worker processes of ImageProcessor.
+    Returns the metrics of the page and, with conf.crop_container,
+    its crops for the container, which is written by the parent.
+    """
+    global _worker_processor
+    if _worker_processor is None:
+        _worker_processor = ImageProcessor(conf)
+    image_processor = _worker_processor
+    # Every page comes with a fresh copy of the metrics, so only its own are handed back.
+    image_processor.conf.metrics = conf.metrics
+    conf = image_processor.conf
+    crops = None
+    if conf.write_crops and conf.crop_container:
+        crops = image_processor._collect_crops(out_dir)
+    image_processor._process_page_file(image_path, out_dir)
+    failed = image_processor.flush_crops()
+    if failed:
+        raise Exception("Could not write crops: {0}".format(failed))
+    return conf.metrics.export(), crops
@@ -0,0 +1,223 @@
+# coding=utf-8
+
+
+"""
+Timing, memory and throughput metrics of the processing stages.
+"""
+
+import json
+import os
+import sys
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+from time import strftime
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory is not reported there.
+    resource = None
+
+
+def _cpu_seconds() -> float:
+    """
+    User and system time of this process and of all its waited-for children
+    (worker processes, ghostscript and tesseract).
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def _thread_cpu_seconds() -> float:
+    """
+    User and system time of the calling thread, None where it is not available.
+    """
+    if resource is None or not hasattr(resource, 'RUSAGE_THREAD'):
+        return None
+    usage = resource.getrusage(resource.RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _peak_rss_mb(who) -> float:
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is given in kilobytes on Linux and in bytes on macOS.
+    if sys.platform == 'darwin':
+        return peak / float(1 << 20)
+    return peak / float(1 << 10)
+
+
+class Metrics:
+    """
+    Collects per stage wall time, cpu time, peak memory and counters.
+
+    Processors open a stage in run(), time their work items (pages, pdf
+    files or tagging batches) with item() and count pages, crops, ocr calls,
+    tokens and errors with count(). Peak memory is the high-water mark of the
+    resident set size at the end of a stage, of this process and of the
+    largest child process. Every item records its wall time, the cpu time of
+    its thread (without child processes like tesseract, Linux only) and the
+    high-water mark of its process when it ends. Worker processes get a fresh copy with the
+    current stage, their measurements are handed back with export() and
+    merge().
+
+    If profile_dir is set, every stage is run under cProfile and its stats
+    are dumped to profile_dir/<stage>.prof. Only the calling thread of the
+    main process is profiled.
+    """
+
+    def __init__(self, profile_dir=None):
+        self.profile_dir = profile_dir
+        self.started = strftime('%Y-%m-%dT%H:%M:%S')
+        self.stages = OrderedDict()
+        self.current = None
+        self.__lock = Lock()
+
+    def __getstate__(self):
+        return {'profile_dir': self.profile_dir, 'current': self.current}
+
+    def __setstate__(self, state):
+        self.__init__(state['profile_dir'])
+        self.current = state['current']
+
+    def __stage(self) -> dict:
+        name = self.current or 'run'
+        if name not in self.stages:
+            self.stages[name] = {'wall_seconds': 0.0,
+                                 'cpu_seconds': 0.0,
+                                 'peak_rss_mb': None,
+                                 'peak_child_rss_mb': None,
+                                 'counts': {},
+                                 'item_seconds': [],
+                                 'item_cpu_seconds': [],
+                                 'item_peak_rss_mb': []}
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Measures a processing stage, optionally under cProfile.
+        """
+        previous, self.current = self.current, name
+        with self.__lock:
+            entry = self.__stage()
+        profiler = None
+        if self.profile_dir:
+            import cProfile
+            profiler = cProfile.Profile()
+
+        wall, cpu = perf_counter(), _cpu_seconds()
+        if profiler:
+            profiler.enable()
+        try:
+            yield entry
+        finally:
+            if profiler:
+                profiler.disable()
+                os.makedirs(self.profile_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(self.profile_dir, name + '.prof'))
+            with self.__lock:
+                entry['wall_seconds'] += perf_counter() - wall
+                entry['cpu_seconds'] += _cpu_seconds() - cpu
+                entry['peak_rss_mb'] = _peak_rss_mb(resource.RUSAGE_SELF) if resource else None
+                entry['peak_child_rss_mb'] = _peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None
+            self.current = previous
+
+    @contextmanager
+    def item(self):
+        """
+        Measures wall time, cpu time and peak memory of one work item of the current stage.
+        """
+        start, cpu = perf_counter(), _thread_cpu_seconds()
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+            cpu = _thread_cpu_seconds() - cpu if cpu is not None else None
+            peak = _peak_rss_mb(resource.RUSAGE_SELF) if resource else None
+            with self.__lock:
+                entry = self.__stage()
+                entry['item_seconds'].append(seconds)
+                if cpu is not None:
+                    entry['item_cpu_seconds'].append(cpu)
+                if peak is not None:
+                    entry['item_peak_rss_mb'].append(peak)
+
+    def count(self, name: str, n=1) -> None:
+        with self.__lock:
+            counts = self.__stage()['counts']
+            counts[name] = counts.get(name, 0) + n
+
+    def export(self) -> dict:
+        """
+        Counters and item measurements of the current stage, e.g. to hand them from a worker process to its parent.
+        """
+        with self.__lock:
+            entry = self.__stage()
+            return {'counts': dict(entry['counts']),
+                    'item_seconds': list(entry['item_seconds']),
+                    'item_cpu_seconds': list(entry['item_cpu_seconds']),
+                    'item_peak_rss_mb': list(entry['item_peak_rss_mb'])}
+
+    def merge(self, exported: dict) -> None:
+        with self.__lock:
+            entry = self.__stage()
+            for name, n in exported['counts'].items():
+                entry['counts'][name] = entry['counts'].get(name, 0) + n
+            entry['item_seconds'].extend(exported['item_seconds'])
+            entry['item_cpu_seconds'].extend(exported['item_cpu_seconds'])
+            entry['item_peak_rss_mb'].extend(exported['item_peak_rss_mb'])
+
+    def report(self) -> dict:
+        stages = OrderedDict()
+        for name, entry in self.stages.items():
+            items = entry['item_seconds']
+            item_cpu = entry['item_cpu_seconds']
+            item_peaks = entry['item_peak_rss_mb']
+            wall = entry['wall_seconds']
+            pages = entry['counts'].get('pages', 0)
+            stages[name] = {'wall_seconds': round(wall, 3),
+                            'cpu_seconds': round(entry['cpu_seconds'], 3),
+                            'peak_rss_mb': entry['peak_rss_mb'] and round(entry['peak_rss_mb'], 1),
+                            'peak_child_rss_mb': entry['peak_child_rss_mb'] and round(entry['peak_child_rss_mb'], 1),
+                            'pages_per_sec': round(pages / wall, 3) if wall and pages else None,
+                            'counts': entry['counts'],
+                            'items': {'count': len(items),
+                                      'mean_seconds': round(sum(items) / len(items), 4) if items else None,
+                                      'max_seconds': round(max(items), 4) if items else None,
+                                      'mean_cpu_seconds': round(sum(item_cpu) / len(item_cpu), 4) if item_cpu else None,
+                                      'max_cpu_seconds': round(max(item_cpu), 4) if item_cpu else None,
+                                      'peak_rss_mb': round(max(item_peaks), 1) if item_peaks else None}}
+        return {'started': self.started, 'stages': stages}
+
+    def dump(self, path: str) -> bool:
+        try:
+            with open(path, mode='w', encoding='utf-8') as fp:
+                json.dump(self.report(), fp, indent=4)
+            return True
+        except Exception as e:
+            raise Exception("Could not write metrics to {0}: {1}".format(path, repr(e)))
+
+    def summary(self) -> str:
+        """
+        Human readable table of the report.
+        """
+        def fmt(value, spec):
+            return '-' if value is None else format(value, spec)
+
+        lines = ["   {0:<10} {1:>9} {2:>9} {3:>9} {4:>10} {5:>11}  {6}"
+                 .format('stage', 'wall s', 'cpu s', 'peak MB', 'pages/s', 'item max s', 'counts')]
+        for name, stage in self.report()['stages'].items():
+            counts = ', '.join('{0} {1}'.format(k, v) for k, v in sorted(stage['counts'].items()))
+            lines.append("   {0:<10} {1:>9} {2:>9} {3:>9} {4:>10} {5:>11}  {6}"
+                         .format(name,
+                                 fmt(stage['wall_seconds'], '.2f'),
+                                 fmt(stage['cpu_seconds'], '.2f'),
+                                 fmt(stage['peak_rss_mb'], '.1f'),
+                                 fmt(stage['pages_per_sec'], '.2f'),
+                                 fmt(stage['items']['max_seconds'], '.2f'),
+                                 counts))
+        return '\n'.join(lines)
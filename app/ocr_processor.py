@@ -7,9 +7,15 @@ Module for tesseract ocr. Uses default system tesseract installation.
 
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
 
-from .util import list_sub_dirs
-from .util import walk_dir
+from .build_cache import BuildCache
+from .crop_store import CropStore
+from .shard import page_key
+from .util import layout_manifest_name
+from .util import read_layout_manifest
+from .util import read_page
 
 from app.config import Config
 
@@ -20,46 +26,207 @@ class OCRProcessor:
             raise TypeError('Need instance of Config class!')
         self.conf = conf
 
-    def __ocr_on_image(self, image_path: str) -> bool:
-
+    def __tesseract_command(self, image_path: str, output_base: str) -> list:
         par = self.conf.params_ocr
+        return ['tesseract', '--tessdata-dir', str(par['tess_dir']),
+                image_path, output_base,
+                '-l', str(par['lan']),
+                '-psm', str(par['page_mode'])]
 
+    def __run_tesseract(self, cmd: list) -> bytes:
+        """
+        Runs tesseract and returns its stdout.
+        Raises an exception on a non-zero exit code or after the timeout.
+        """
+        from subprocess import PIPE
+        from subprocess import TimeoutExpired
+        from subprocess import run
+
+        env = os.environ.copy()
+        if self.conf.jobs > 1:
+            # Several tesseract processes run at once, each one gets a single thread.
+            env['OMP_THREAD_LIMIT'] = '1'
+        timeout = self.conf.params_ocr.get('timeout')
+        self.conf.metrics.count('ocr_calls')
+        try:
+            result = run(cmd, stdout=PIPE, stderr=PIPE, env=env, timeout=timeout)
+        except TimeoutExpired:
+            raise Exception("Tesseract timed out after {0} s: {1}".format(timeout, cmd[3]))
+        if result.returncode != 0:
+            raise Exception("Tesseract failed with exit code {0} on {1}: {2}"
+                            .format(result.returncode, cmd[3], result.stderr.decode('utf-8', 'replace').strip()))
+        return result.stdout
+
+    def __ocr_on_image(self, image_path: str) -> bool:
         if not os.path.exists(image_path):
             return False
 
+        image_path = os.path.abspath(image_path)
         dir_name = os.path.dirname(image_path)
         file_name = str(os.path.basename(image_path).split('.')[0])
 
         try:
-            os.chdir(dir_name)
-        except OSError as e:
+            self.__run_tesseract(self.__tesseract_command(image_path, os.path.join(dir_name, file_name)))
+        except Exception as e:
             logging.error(e)
             return False
+        self.conf.catalog.add_file(os.path.join(dir_name, file_name + '.txt'))
+        return True
+
+    def ocr_image(self, image) -> str:
+        """
+        Runs tesseract on an image held in memory and returns the recognized text.
+
+        The image is handed over as temporary file, the text is read from stdout.
+        """
+        from tempfile import TemporaryDirectory
+
+        from skimage import io
+
+        with TemporaryDirectory() as tmp_dir:
+            image_path = os.path.join(tmp_dir, 'crop.png')
+            io.imsave(image_path, image)
+            text = self.__run_tesseract(self.__tesseract_command(image_path, 'stdout'))
+        return text.decode('utf-8')
+
+    def __ocr_on_page(self, page_dir: str, images: list, manifest: dict) -> bool:
+        with self.conf.metrics.item():
+            if not images and manifest:
+                return self.__ocr_on_manifest(page_dir, manifest)
+            return all([self.__ocr_on_image(image) for image in images])
+
+    def __ocr_on_manifest(self, page_dir: str, manifest: dict) -> bool:
+        """
+        Runs tesseract on the crops of a layout manifest.
+        npy crops are loaded, all others are cut from the original page.
+        """
+        import numpy as np
 
-        os.system('tesseract --tessdata-dir {0} {1} {2} -l {3} -psm {4}'.format(par['tess_dir'],
-                                                                                image_path,
-                                                                                file_name,
-                                                                                par['lan'],
-                                                                                par['page_mode']))
+        if manifest.get('container'):
+            return self.__ocr_on_container(page_dir, manifest)
+
+        crop_paths = [os.path.join(page_dir, crop['name'] + '.npy') for crop in manifest['crops']]
+        page = None
+        if manifest.get('crop_type') != 'npy' or not all(os.path.exists(path) for path in crop_paths):
+            page_path = os.path.join(os.path.dirname(page_dir), manifest['page'])
+            if not os.path.exists(page_path):
+                logging.error('Could not find original page {0} of {1}'.format(page_path, page_dir))
+                return False
+            page = read_page(page_path, self.conf.pixel_type)
+
+        for crop, crop_path in zip(manifest['crops'], crop_paths):
+            if page is None:
+                crop_image = np.load(crop_path)
+            else:
+                top, bottom, left, right = crop['box']
+                crop_image = page[top:bottom, left:right]
+            text = self.ocr_image(crop_image)
+            with open(os.path.join(page_dir, crop['name'] + '.txt'), mode='w', encoding='utf-8') as fp:
+                fp.write(text)
+            self.conf.catalog.add_file(os.path.join(page_dir, crop['name'] + '.txt'))
+        return True
+
+    def __ocr_on_container(self, page_dir: str, manifest: dict) -> bool:
+        """
+        Runs tesseract on the crops of a page, read from the container of its document.
+        """
+        store = CropStore(os.path.dirname(page_dir), manifest['container'])
+        try:
+            for crop in manifest['crops']:
+                text = self.ocr_image(store.read(crop['entry']))
+                with open(os.path.join(page_dir, crop['name'] + '.txt'), mode='w', encoding='utf-8') as fp:
+                    fp.write(text)
+                self.conf.catalog.add_file(os.path.join(page_dir, crop['name'] + '.txt'))
+        finally:
+            store.close()
         return True
 
     def __ocr_on_image_stack(self) -> bool:
         # Read Directories for processed PDF files
         in_dir = self.conf.in_dir
-        docs = list_sub_dirs(in_dir)
+        catalog = self.conf.catalog
+        catalog.scan(in_dir)
+        docs = catalog.list_sub_dirs(in_dir)
         file_type = self.conf.image_type
         if not docs:
             raise Exception('There are no documents in directory: {0}'.format(in_dir))
+        if self.conf.verbose:
+            print("++ OCR Processor ++")
+            print("   Processing file(s) in path " + in_dir)
+
+        cache = None
+        if self.conf.incremental:
+            cache = BuildCache(in_dir, 'ocr', {'params_ocr': self.conf.params_ocr, 'image_type': file_type},
+                               file_name=self.conf.shard.file_name(BuildCache.file_name))
+
         # Read Directories of all pages in a PDF directory
+        pages = []
         for one_doc in docs:
-            all_page_in_doc = list_sub_dirs(one_doc)
+            all_page_in_doc = self.conf.shard.select('ocr', catalog.list_sub_dirs(one_doc), key=page_key)
             for page in all_page_in_doc:
-                for image in walk_dir(page, file_type=file_type):
-                    self.__ocr_on_image(image)
+                manifest = read_layout_manifest(page)
+                crop_type = manifest.get('crop_type', file_type) if manifest else file_type
+                # Tesseract cannot read npy crops, they are handed over from memory.
+                images = catalog.walk_dir(page, file_type=crop_type) if crop_type != 'npy' else []
+                digest = None
+                if cache:
+                    digest = cache.outdated(cache.key(page), *self.__page_files(page, images, manifest))
+                    if not digest:
+                        self.conf.shard.skipped('ocr', page_key(page))
+                        continue
+                pages.append((page, images, manifest, digest))
+
+        # Pages are spread over conf.jobs threads, each one waits for one tesseract process at a time.
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, self.conf.jobs)) as executor:
+                futures = {executor.submit(self.__ocr_on_page, page, images, manifest): (page, digest)
+                           for page, images, manifest, digest in pages}
+                for future in as_completed(futures):
+                    page, digest = futures[future]
+                    try:
+                        if not future.result():
+                            self.conf.metrics.count('errors')
+                            continue
+                    except Exception as e:
+                        self.conf.metrics.count('errors')
+                        logging.error("Could not run ocr on page {0}: {1}".format(page, repr(e)))
+                        continue
+                    self.conf.metrics.count('pages')
+                    self.conf.shard.done('ocr', page_key(page))
+                    if self.conf.verbose:
+                        print("    ... " + page + " ... ")
+                    if cache:
+                        cache.record(cache.key(page), digest)
+        finally:
+            if cache:
+                cache.save()
+
+        if self.conf.verbose:
+            print("++++++++++++++++++++++")
+
         return True
 
+    @staticmethod
+    def __page_files(page_dir: str, images: list, manifest: dict) -> tuple:
+        """
+        Returns input and output files of the ocr of a page.
+        """
+        if not images and manifest:
+            inputs = [os.path.join(page_dir, layout_manifest_name),
+                      os.path.join(os.path.dirname(page_dir), manifest['page'])]
+            if manifest.get('container'):
+                # The crops are read from the container, which changes when the image stage runs again.
+                inputs.append(os.path.join(os.path.dirname(page_dir), manifest['container']))
+            names = [crop['name'] for crop in manifest['crops']]
+        else:
+            inputs = images
+            names = [str(os.path.basename(image).split('.')[0]) for image in images]
+        outputs = [os.path.join(page_dir, name + '.txt') for name in names]
+        return inputs, outputs
+
     def run(self) -> None:
         try:
-            self.__ocr_on_image_stack()
+            with self.conf.metrics.stage('ocr'):
+                self.__ocr_on_image_stack()
         except KeyboardInterrupt:
             print("\nComputation cancelled.")
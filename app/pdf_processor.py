@@ -3,8 +3,8 @@
 
 import logging
 
+from .build_cache import BuildCache
 from .util import clear_dir
-from .util import walk_dir
 
 from app.config import Config
 
@@ -15,10 +15,198 @@ class PDFProcessor:
             raise TypeError('Need instance of Config class!')
         self.conf = conf
 
+    @staticmethod
+    def __gs_device(image_type: str) -> str:
+        if image_type == 'png':
+            return 'pngmono'
+        elif image_type in ('tif', 'tiff'):
+            return 'tiffgray'
+        elif image_type in ('jpg', 'jpeg'):
+            return 'jpeggray'
+        else:
+            return 'pngmono'
+
+    @staticmethod
+    def page_count(pdf_path: str) -> int:
+        """
+        Asks Ghostscript for the number of pages in a pdf file.
+        Ghostscript runs with -dSAFER and may read only this file.
+        """
+        from os.path import abspath
+        from subprocess import check_output
+
+        pdf_path = abspath(pdf_path)
+        ps_path = pdf_path.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+        cmd = ['gs', '-q', '-dNODISPLAY', '-dSAFER', '--permit-file-read=' + pdf_path,
+               '-c', '({0}) (r) file runpdfbegin pdfpagecount = quit'.format(ps_path)]
+        try:
+            return int(check_output(cmd).decode().strip())
+        except Exception as e:
+            raise Exception("Could not count pages of {0}: {1}".format(pdf_path, repr(e)))
+
+    @staticmethod
+    def __gs_command(pdf_path: str, output_file: str, device: str, dpi: str, first=None, last=None) -> list:
+        cmd = ['gs', '-q', '-dSAFER', '-sDEVICE=' + device, '-r' + str(dpi), '-dBATCH', '-dNOPAUSE']
+        if first:
+            cmd += ['-dFirstPage=' + str(first), '-dLastPage=' + str(last)]
+        cmd += ['-sOutputFile=' + output_file, pdf_path]
+        return cmd
+
+    @staticmethod
+    def __run_gs(cmd: list) -> bool:
+        from subprocess import PIPE
+        from subprocess import run
+
+        result = run(cmd, stdout=PIPE, stderr=PIPE)
+        if result.returncode != 0:
+            raise Exception("Ghostscript failed with exit code {0}: {1}"
+                            .format(result.returncode, result.stderr.decode('utf-8', 'replace').strip()))
+        return True
+
+    @staticmethod
+    def __page_ranges(first_page: int, last_page: int, parts: int) -> list:
+        """
+        Splits pages first_page to last_page into at most parts consecutive (first, last) ranges.
+        """
+        from math import ceil
+
+        size = max(1, int(ceil((last_page - first_page + 1) / max(1, parts))))
+        return [(first, min(first + size - 1, last_page)) for first in range(first_page, last_page + 1, size)]
+
+    def __selected_pages(self, pdf_path: str) -> tuple:
+        """
+        Returns first and last page to render, limited by conf.page_range.
+        """
+        page_count = self.page_count(pdf_path)
+        if not self.conf.page_range:
+            return 1, page_count
+        first, last = self.conf.page_range
+        return max(1, first), min(last or page_count, page_count)
+
+    @staticmethod
+    def __read_pnm_header(stream) -> tuple:
+        """
+        Reads the header of a binary PBM (P4) or PGM (P5) image from a stream.
+        Returns (magic, width, height, maxval) or None at the end of the stream.
+        """
+        tokens = []
+        token = b''
+        while len(tokens) < (3 if tokens[:1] == [b'P4'] else 4):
+            byte = stream.read(1)
+            if not byte:
+                if tokens or token:
+                    raise Exception('Truncated image header in Ghostscript output.')
+                return None
+            if byte == b'#' and not token:
+                stream.readline()
+                continue
+            if byte.isspace():
+                if token:
+                    tokens.append(token)
+                    token = b''
+                continue
+            token += byte
+        magic, width, height = tokens[0], int(tokens[1]), int(tokens[2])
+        maxval = int(tokens[3]) if magic == b'P5' else 1
+        if magic not in (b'P4', b'P5') or maxval > 255:
+            raise Exception('Unsupported image format in Ghostscript output: {0}'.format(tokens))
+        return magic, width, height, maxval
+
+    @staticmethod
+    def __read_exactly(stream, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = stream.read(size - len(data))
+            if not chunk:
+                raise Exception('Truncated image data in Ghostscript output.')
+            data += chunk
+        return bytes(data)
+
+    def __read_pnm(self, stream):
+        """
+        Reads the next page of a PBM/PGM stream into a uint8 array.
+        Returns None at the end of the stream.
+        """
+        import numpy as np
+
+        header = self.__read_pnm_header(stream)
+        if not header:
+            return None
+        magic, width, height, maxval = header
+        if magic == b'P4':
+            row_bytes = (width + 7) // 8
+            bits = np.frombuffer(self.__read_exactly(stream, row_bytes * height), dtype=np.uint8)
+            bits = np.unpackbits(bits.reshape(height, row_bytes), axis=1)[:, :width]
+            # In PBM 1 is black, pages are white (255) with black (0) ink.
+            return ((1 - bits) * 255).astype(np.uint8)
+        data = np.frombuffer(self.__read_exactly(stream, width * height), dtype=np.uint8)
+        return data.reshape(height, width).copy()
+
+    def iter_pages(self, pdf_path: str, first=None, last=None):
+        """
+        Rasterizes a pdf file page by page, without writing any file.
+
+        Yields tuples of page no and grey scale page image as uint8 array.
+        Ghostscript writes raw PBM (png) or PGM (tif, jpg) images to a pipe,
+        which are read into arrays one at a time. If first and last are not
+        given, conf.page_range selects the pages.
+        """
+        from subprocess import PIPE
+        from subprocess import Popen
+        from tempfile import TemporaryFile
+
+        if first is None:
+            first, last = self.__selected_pages(pdf_path)
+        if last < first:
+            return
+        device = 'pbmraw' if self.__gs_device(self.conf.image_type) == 'pngmono' else 'pgmraw'
+        cmd = self.__gs_command(pdf_path, '-', device, self.conf.pdf_dpi, first=first, last=last)
+        # Keep PostScript messages out of the image stream.
+        cmd.insert(1, '-sstdout=%stderr')
+
+        with TemporaryFile() as err:
+            process = Popen(cmd, stdout=PIPE, stderr=err)
+            try:
+                page_no = first
+                while True:
+                    page = self.__read_pnm(process.stdout)
+                    if page is None:
+                        break
+                    yield str(page_no), page
+                    page_no += 1
+            finally:
+                process.stdout.close()
+                returncode = process.wait()
+            if returncode != 0:
+                err.seek(0)
+                raise Exception("Ghostscript failed with exit code {0}: {1}"
+                                .format(returncode, err.read().decode('utf-8', 'replace').strip()))
+
+    def __render_range(self, pdf_path: str, out_dir: str, page_range: tuple, device: str, dpi: str,
+                       image_type: str) -> bool:
+        """
+        Renders a range of pages into out_dir, named by their page no in the pdf.
+
+        Ghostscript numbers the output of every range from 1, so each range
+        is rendered into a temporary directory and renamed afterwards.
+        """
+        from os import rename
+        from os.path import join
+        from tempfile import TemporaryDirectory
+
+        first, last = page_range
+        with TemporaryDirectory(prefix='.range_', dir=out_dir) as tmp_dir:
+            self.__run_gs(self.__gs_command(pdf_path, join(tmp_dir, '%d.' + image_type), device, dpi,
+                                            first=first, last=last))
+            for offset in range(last - first + 1):
+                rename(join(tmp_dir, str(offset + 1) + '.' + image_type),
+                       join(out_dir, str(first + offset) + '.' + image_type))
+        return True
+
     def __pdf_to_image(self, pdf_path: str, dpi: str, image_type: str):
+        from concurrent.futures import ThreadPoolExecutor
         from os import listdir
         from os import mkdir
-        from os import system
         from os.path import basename
         from os.path import join
 
@@ -31,19 +219,26 @@ class PDFProcessor:
             pass
         if listdir(new_dir):
             clear_dir(new_dir, file_ext=['.png', '.jpg', '.tif', '.tiff'])
-        gs_command = 'gs'
         file_extension = image_type
-        if file_extension == 'png':
-            device = 'pngmono'
-        elif file_extension in ('tif', 'tiff'):
-            device = 'tiffgray'
-        elif file_extension in ('jpg', 'jpeg'):
-            device = 'jpeggray'
+        device = self.__gs_device(file_extension)
+
+        jobs = self.conf.jobs
+        if jobs > 1 or self.conf.page_range:
+            page_ranges = self.__page_ranges(*self.__selected_pages(pdf_path), parts=jobs)
         else:
-            device = 'pngmono'
-        cmd = '{0} -q -dSAFER -sDEVICE={1} -r{2} -dBATCH -dNOPAUSE -sOutputFile={3}%d.{4} {5}'\
-            .format(gs_command, device, dpi, join(out_dir, dir_name) + '/', file_extension, pdf_path)
-        system(cmd)
+            page_ranges = []
+
+        if len(page_ranges) <= 1 and not self.conf.page_range:
+            self.__run_gs(self.__gs_command(pdf_path, join(new_dir, '%d.' + file_extension), device, dpi))
+            return True
+
+        # Every range runs in its own Ghostscript process, the threads only wait for them.
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(self.__render_range, pdf_path, new_dir, page_range,
+                                       device, dpi, file_extension)
+                       for page_range in page_ranges]
+            for future in futures:
+                future.result()
 
         return True
 
@@ -53,9 +248,12 @@ class PDFProcessor:
         One image file per one pdf page is created and saved.
         File name is the pdf page no.
         """
+        from os.path import basename
+        from os.path import join
+
         in_dir = self.conf.in_dir
         dpi = self.conf.pdf_dpi
-        pdf_files = walk_dir(in_dir, file_type='pdf')
+        pdf_files = self.conf.catalog.walk_dir(in_dir, file_type='pdf')
 
         if self.conf.verbose:
             print("++ PDF Processor ++")
@@ -64,17 +262,46 @@ class PDFProcessor:
         if not pdf_files:
             raise Exception('No PDF files found in: {0}'.format(in_dir))
 
+        # Documents are split between shards as a whole.
+        pdf_files = self.conf.shard.select('pdf', pdf_files, key=lambda pdf_path: basename(pdf_path).split('.')[0])
+
         image_type = self.conf.image_type
-        for pdf_path in pdf_files:
-            if self.conf.verbose:
-                print("    ... " + pdf_path + " ... ")
-            self.__pdf_to_image(pdf_path, dpi, image_type)
+        cache = None
+        if self.conf.incremental:
+            cache = BuildCache(self.conf.out_dir, 'pdf', {'dpi': dpi, 'image_type': image_type,
+                                                       'page_range': self.conf.page_range},
+                               file_name=self.conf.shard.file_name(BuildCache.file_name))
+        try:
+            for pdf_path in pdf_files:
+                doc = basename(pdf_path).split('.')[0]
+                new_dir = join(self.conf.out_dir, doc)
+                digest = None
+                if cache:
+                    digest = cache.outdated(cache.key(pdf_path), [pdf_path], [new_dir])
+                    if not digest:
+                        self.conf.shard.skipped('pdf', doc)
+                        continue
+                if self.conf.verbose:
+                    print("    ... " + pdf_path + " ... ")
+                with self.conf.metrics.item():
+                    self.__pdf_to_image(pdf_path, dpi, image_type)
+                # Pages are written by ghostscript, the document is listed again.
+                self.conf.catalog.add_dir(new_dir)
+                self.conf.metrics.count('pdfs')
+                self.conf.metrics.count('pages', len(self.conf.catalog.walk_dir(new_dir, image_type)))
+                if cache:
+                    cache.record(cache.key(pdf_path), digest)
+                self.conf.shard.done('pdf', doc)
+        finally:
+            if cache:
+                cache.save()
         if self.conf.verbose:
             print("++++++++++++++++++++++")
         return True
 
     def run(self) -> None:
         try:
-            self.__process_pdf_stack()
+            with self.conf.metrics.stage('pdf'):
+                self.__process_pdf_stack()
         except KeyboardInterrupt:
             print("\nComputation cancelled.")
@@ -0,0 +1,240 @@
+# coding=utf-8
+
+
+"""
+Importable entry point to run the processing stages without run.py.
+"""
+
+from os.path import abspath
+from os.path import basename
+from os.path import dirname
+from os.path import join
+
+from .metrics import Metrics
+from .shard import Shard
+from .shard import page_key
+
+from app.config import Config
+
+
+process_order = ('pdf', 'image', 'chronicle', 'ocr', 'pos')
+
+# Stages of an in-memory page and the stages they need before them.
+page_stages = ('image', 'chronicle', 'ocr', 'pos')
+stage_requires = {'chronicle': 'image', 'ocr': 'image', 'pos': 'ocr'}
+
+
+def check_requires(stages) -> None:
+    """
+    Raises if a page stage runs without a stage it needs, e.g. ocr without image.
+    """
+    for stage in stages:
+        required = stage_requires.get(stage)
+        if required and required not in stages:
+            raise Exception('Stage {0} needs stage {1}'.format(stage, required))
+
+
+class Pipeline:
+    """
+    Runs the stages of a Config on a tree, a document, a page or a page array.
+
+        pipeline = Pipeline(conf, ['image', 'ocr'])
+        result = pipeline.run(page='/tree/vol1/12.png')
+        result = pipeline.process(page_array)
+
+    A processor, and with it its modules like skimage or the TreeTagger
+    wrapper, is only loaded when its stage runs first. Processors are kept
+    for the following calls, so many small jobs share one interpreter,
+    the parameters, the directory listings and the started taggers.
+
+    Stage errors are not printed but returned with the results.
+    """
+
+    def __init__(self, conf, stages=process_order):
+        if not isinstance(conf, Config) or not conf:
+            raise TypeError('Need instance of Config class!')
+        self.conf = conf
+        self.stages = self.__check_stages(stages, process_order)
+        self.processors = {}
+
+    @staticmethod
+    def __check_stages(stages, allowed) -> tuple:
+        if not stages or any(stage not in allowed for stage in stages):
+            raise Exception('Stages must be out of {0}: {1}'.format(', '.join(allowed), stages))
+        return tuple(stage for stage in allowed if stage in stages)
+
+    def processor(self, stage: str):
+        """
+        Returns the processor of stage, imported and created at its first use.
+        """
+        if stage not in self.processors:
+            if stage == 'pdf':
+                from .pdf_processor import PDFProcessor
+                self.processors[stage] = PDFProcessor(self.conf)
+            elif stage == 'image':
+                from .layout_processor import ImageProcessor
+                self.processors[stage] = ImageProcessor(self.conf)
+            elif stage == 'chronicle':
+                from .chronicle_processor import ChronicleProcessor
+                self.processors[stage] = ChronicleProcessor(self.conf)
+            elif stage == 'ocr':
+                from .ocr_processor import OCRProcessor
+                self.processors[stage] = OCRProcessor(self.conf)
+            elif stage == 'pos':
+                from .pos_processor import POSProcessor
+                self.processors[stage] = POSProcessor(self.conf)
+            else:
+                raise Exception('Unknown stage: {0}'.format(stage))
+        return self.processors[stage]
+
+    @staticmethod
+    def scope(in_dir=None, out_dir=None, pdf=None, page=None, crops=None) -> tuple:
+        """
+        Returns in_dir, out_dir and the document or page keys of a source, None for the whole tree.
+        in_dir and out_dir of a pdf, page image or crop (page) directory default to its tree.
+        """
+        keys = None
+        root = None
+        if pdf:
+            path = abspath(pdf)
+            root, keys = dirname(path), [basename(path).split('.')[0]]
+        elif page or crops:
+            path = abspath(page or crops)
+            root, keys = dirname(dirname(path)), [page_key(path)]
+        in_dir = in_dir or root
+        if not in_dir:
+            raise Exception('Source needs one of in_dir, pdf, page or crops')
+        return in_dir, out_dir or in_dir, keys
+
+    def run(self, in_dir=None, out_dir=None, pdf=None, page=None, crops=None, stages=None,
+            metrics=None, shard=None) -> dict:
+        """
+        Runs the stages, or the given part of them, on files and returns
+
+            {'status': 'done' or 'failed',
+             'errors': [{'stage': ..., 'error': ...}],
+             'stages': {stage: {'done': [keys], 'skipped': [keys], 'failed': [keys]}},
+             'metrics': Metrics.report()}
+
+        The whole tree in_dir is processed, or only the pdf, page image or
+        crops. Stages after pdf process the pages it wrote to out_dir. Failed
+        lists the work items a stage owned, but neither processed nor found current.
+
+        The run records into metrics and shard, by default into new ones for
+        conf.shard and the source. The directories, metrics and shard of the
+        Config are restored afterwards.
+        """
+        conf = self.conf
+        stages = self.__check_stages(stages, self.stages) if stages is not None else self.stages
+        in_dir, out_dir, keys = self.scope(in_dir, out_dir, pdf, page, crops)
+        saved = conf.in_dir, conf.out_dir, conf.metrics, conf.shard
+        try:
+            conf.in_dir = in_dir
+            conf.out_dir = out_dir
+            conf.metrics = metrics or Metrics(profile_dir=conf.metrics.profile_dir)
+            conf.shard = shard or Shard(conf.shard.index, conf.shard.count, keys)
+            return self.__run(stages, in_dir, out_dir, keys)
+        finally:
+            conf.in_dir, conf.out_dir, conf.metrics, conf.shard = saved
+
+    def __run(self, stages: tuple, in_dir: str, out_dir: str, keys) -> dict:
+        conf = self.conf
+
+        # Files may have changed since the last run, e.g. after manual corrections.
+        # For single documents or pages the tree itself is read again, but
+        # only the listings of their documents are dropped.
+        for path in {in_dir, out_dir}:
+            conf.catalog.forget(path, below=keys is None)
+            for key in keys or []:
+                conf.catalog.forget(join(path, key.split('/')[0]))
+
+        errors = []
+        for stage in stages:
+            try:
+                self.processor(stage).run()
+            except Exception as e:
+                errors.append({'stage': stage, 'error': repr(e)})
+            if stage == 'pdf':
+                # The following stages process the pages written to out_dir.
+                conf.in_dir = out_dir
+        if keys is not None and not any(entry['owned'] for entry in conf.shard.stages.values()):
+            errors.append({'stage': None,
+                           'error': 'Nothing found to process for {0} in {1}'.format(', '.join(keys), in_dir)})
+
+        results = {}
+        for stage, entry in conf.shard.stages.items():
+            finished = set(entry['done']) | set(entry['skipped'])
+            results[stage] = {'done': entry['done'],
+                              'skipped': entry['skipped'],
+                              'failed': [key for key in entry['owned'] if key not in finished]}
+
+        failed = errors or any(entry['failed'] for entry in results.values())
+        return {'status': 'failed' if failed else 'done',
+                'errors': errors,
+                'stages': results,
+                'metrics': conf.metrics.report()}
+
+    def process(self, page, stages=None) -> dict:
+        """
+        Runs the page stages on a page image held in memory, nothing is written.
+        The page is converted to conf.pixel_type like a page read from a file. Returns
+
+            {'status': 'done' or 'failed',
+             'errors': [{'stage': ..., 'error': ...}],
+             'boxes': [(top, bottom, left, right)], 'names': [crop names],
+             'crops': [arrays], 'texts': [ocr texts], 'tags': [pos tags per text]}
+
+        with the entries of the stages that ran. Stages after a failed one are not run.
+        """
+        from .util import grey_page
+
+        stages = stages if stages is not None else [stage for stage in self.stages if stage in page_stages]
+        stages = self.__check_stages(stages, page_stages)
+
+        result = {'status': 'done', 'errors': []}
+        try:
+            check_requires(stages)
+            item = {'page': grey_page(page, self.conf.pixel_type)}
+        except Exception as e:
+            result['status'] = 'failed'
+            result['errors'].append({'stage': None, 'error': repr(e)})
+            return result
+        for stage in stages:
+            try:
+                self.process_stage(stage, item)
+            except Exception as e:
+                result['status'] = 'failed'
+                result['errors'].append({'stage': stage, 'error': repr(e)})
+                break
+        del item['page']
+        result.update(item)
+        return result
+
+    def process_stage(self, stage: str, item: dict) -> dict:
+        """
+        Runs one page stage on item, which holds the grey scale 'page' and the
+        entries of the stages before. Adds 'boxes', 'names' and 'crops' (image),
+        renames them (chronicle), adds 'texts' (ocr) or 'tags' (pos).
+        Shared by process() and the StreamProcessor.
+        """
+        if stage == 'image':
+            page = item['page']
+            boxes = self.processor('image').text_boxes(page)
+            # Number like the saved crops: empty boxes are dropped, but keep their number.
+            named = [(box, str(i)) for i, box in enumerate(boxes, 1) if box[0] < box[1] and box[2] < box[3]]
+            item['boxes'] = [box for box, __ in named]
+            item['names'] = [name for __, name in named]
+            item['crops'] = [page[top:bottom, left:right] for top, bottom, left, right in item['boxes']]
+        elif stage == 'chronicle':
+            from .chronicle_processor import ChronicleProcessor
+            widths = [crop.shape[1] for crop in item['crops']]
+            for frag, indices in ChronicleProcessor.assign_fragments(widths, item['page'].shape[1]).items():
+                for i in indices:
+                    item['names'][i] += '_' + frag
+        elif stage == 'ocr':
+            item['texts'] = [self.processor('ocr').ocr_image(crop) for crop in item['crops']]
+        elif stage == 'pos':
+            item['tags'] = self.processor('pos').tag_texts(item['texts'], self.conf.lang)
+        else:
+            raise Exception('Unknown page stage: {0}'.format(stage))
+        return item
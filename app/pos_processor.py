@@ -5,96 +5,251 @@
 Uses tree-tagger chunker, tagger and lemmatizer on text files.
 """
 
+import logging
 import os
 
 
 class POSProcessor:
+    # Separates the texts of a batch in the TreeTagger input and output.
+    doc_boundary = '<pos_doc_boundary/>'
+
     def __init__(self, conf):
         from app.config import Config
         if not isinstance(conf, Config) or not conf:
             raise TypeError('Need instance of Config class!')
         self.conf = conf
+        self.__taggers = {}
 
-    def __tag_file_tree_tagger(self, path: str, lang: str, tree_tagger_dir: str) -> list:
-        """
-        @path: path of file.
-        @lang: language to be used for tagging.
-        Chunking and tagging of a file using the TreeTagger.
-        Returns a json-skeleton on success. Skeleton can be used to create
-        a json file and to reload tagging results.
-        Returns None on Failure.
-        """
-        from treetaggerwrapper import TreeTagger
-        from treetaggerwrapper import make_tags
-
+    @staticmethod
+    def __read_txt(path: str) -> str:
         from .util import open_file
 
-        json_skeleton = []
-        if lang not in ('en', 'es', 'de', 'fr'):
-            raise Exception('{0} language not supported by TreeTagger!'.format(lang))
         fp = open_file(path)
         if not fp:
-            return []
+            return ''
         try:
             txt = fp.read()
             fp.close()
+            return txt
         except Exception as e:
             raise Exception("Could not read txt file: {0}, {1}".format(path, repr(e)))
 
-        # TODO: Find a way to include treetagger location.
-        tagger = TreeTagger(TAGLANG=lang, TAGDIR='/Users/eugenstroh/TreeTagger')
-        tags = tagger.tag_text(txt)
-        tags = make_tags(tags)
-        if not tags:
+    def __tree_tagger(self, lang: str):
+        """
+        Returns the TreeTagger for lang. One tagger per language is started
+        and kept for the whole run.
+        """
+        from treetaggerwrapper import TreeTagger
+
+        if lang not in ('en', 'es', 'de', 'fr'):
+            raise Exception('{0} language not supported by TreeTagger!'.format(lang))
+
+        if lang not in self.__taggers:
+            self.__taggers[lang] = TreeTagger(TAGLANG=lang, TAGDIR=self.conf.params_tagger['tagger_dir'])
+        return self.__taggers[lang]
+
+    def tag_text(self, txt: str, lang: str) -> list:
+        """
+        @txt: text to be tagged.
+        @lang: language to be used for tagging.
+        Chunking and tagging of a text using the TreeTagger.
+        Returns a json-skeleton of word, pos and lemma for each token.
+        """
+        return self.tag_texts([txt], lang)[0]
+
+    def tag_texts(self, texts: list, lang: str) -> list:
+        """
+        @texts: texts to be tagged.
+        @lang: language to be used for tagging.
+        Tags all texts in a single TreeTagger call. The texts are separated
+        by an SGML tag, which TreeTagger passes through untouched, so the
+        result can be split back into one json-skeleton per text.
+        Returns a list of json-skeletons in the order of texts.
+        """
+        from treetaggerwrapper import Tag
+        from treetaggerwrapper import make_tags
+
+        if not texts:
             return []
+
+        tagger = self.__tree_tagger(lang)
+        boundary = '\n' + POSProcessor.doc_boundary + '\n'
+        tags = make_tags(tagger.tag_text(boundary.join(texts)))
+
+        json_skeletons = [[]]
         for tag in tags:
-            w = {'word': tag.word,
-                 'pos': tag.pos,
-                 'lemma': tag.lemma}
-            json_skeleton.append(w)
+            if not isinstance(tag, Tag):
+                if tag.what.strip() == POSProcessor.doc_boundary:
+                    json_skeletons.append([])
+                continue
+            json_skeletons[-1].append({'word': tag.word,
+                                       'pos': tag.pos,
+                                       'lemma': tag.lemma})
 
-        try:
-            return json_skeleton
-        except Exception as e:
-            raise Exception("Could not parse json: {0}".format(repr(e)))
+        if len(json_skeletons) != len(texts):
+            raise Exception("Could not split tagged batch: {0} results for {1} texts"
+                            .format(len(json_skeletons), len(texts)))
+        return json_skeletons
 
     def __tag_file_stanford_tagger(self, path: str, lang: str) -> list:
         pass
 
+    @staticmethod
+    def __result_name(txt: str) -> str:
+        fname = os.path.basename(txt)
+        if 'pos' in fname:
+            # Truncate _pos.txt
+            fname = fname[:-8]
+        else:
+            # Truncate .txt
+            fname = str(fname.split('.')[0])
+        return fname
+
+    def tag_files(self, txt_files: list, lang: str) -> list:
+        """
+        Reads and tags text files in one TreeTagger call.
+        Returns a list of json-skeletons in the order of txt_files.
+        """
+        return self.tag_texts([self.__read_txt(txt) for txt in txt_files], lang)
+
+    def __write_batch(self, batch: list, json_objs: list, cache) -> bool:
+        """
+        Writes the results of a batch of pages in conf.pos_format.
+        """
+        from .pos_store import page_pos_files
+        from .pos_store import pos_output_files
+        from .pos_store import write_pos_results
+        from .shard import page_key
+
+        self.conf.metrics.count('text_files', len(json_objs))
+        self.conf.metrics.count('tokens', sum(len(obj) for obj in json_objs))
+        json_objs = iter(json_objs)
+        for page, digest, files, names in batch:
+            for path in page_pos_files(page):
+                self.conf.catalog.remove_file(path)
+            write_pos_results(page, list(zip(names, json_objs)), self.conf.pos_format)
+            for path in pos_output_files(page, names, self.conf.pos_format):
+                self.conf.catalog.add_file(path)
+            if cache:
+                cache.record(cache.key(page), digest)
+            self.conf.metrics.count('pages')
+            self.conf.shard.done('pos', page_key(page))
+        return True
+
+    def __tag_batches_parallel(self, batches: list, cache) -> bool:
+        """
+        Shards batches across conf.jobs worker processes, each with its own
+        long-lived TreeTagger. Only this process writes the results, so
+        output files never collide. A failing batch does not stop the others.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        from concurrent.futures import as_completed
+
+        failed = 0
+        with ProcessPoolExecutor(max_workers=self.conf.jobs) as executor:
+            futures = {executor.submit(_tag_files_worker, self.conf,
+                                       [txt for __, __, files, __ in batch for txt in files]): batch
+                       for batch in batches}
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    json_objs, metrics = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.conf.metrics.count('errors')
+                    logging.error("Could not tag pages {0}: {1}".format([page for page, __, __, __ in batch], repr(e)))
+                    continue
+                self.conf.metrics.merge(metrics)
+                self.__write_batch(batch, json_objs, cache)
+                if self.conf.verbose:
+                    for page, __, __, __ in batch:
+                        print("   ... " + page + " ... ")
+
+        if failed:
+            print("   {0} of {1} batch(es) failed.".format(failed, len(batches)))
+
+        return not failed
+
     # TODO: Change triple loop, use a recursive search through path.
     def __tag_file_stack(self):
-        from .util import list_sub_dirs
-        from .util import walk_dir
-        from .util import dump_obj_to_json
+        from .build_cache import BuildCache
+        from .pos_store import pos_output_files
+        from .shard import page_key
 
         in_dir = self.conf.in_dir
-        all_docs = list_sub_dirs(in_dir)
+        catalog = self.conf.catalog
+        catalog.scan(in_dir)
+        all_docs = catalog.list_sub_dirs(in_dir)
 
         if self.conf.verbose:
             print("++ POS Processor ++")
             print("   Processing " +  str(len(all_docs)) + " directory(ies) in path " + in_dir)
+        cache = None
+        if self.conf.incremental:
+            cache = BuildCache(in_dir, 'pos', {'lang': self.conf.lang, 'pos_format': self.conf.pos_format},
+                               file_name=self.conf.shard.file_name(BuildCache.file_name))
+
+        # Pages are never split, so a page is recorded once all its files are written.
+        batch_size = self.conf.params_tagger['batch_size']
+        batches = [[]]
         for doc in all_docs:
-            doc_page = list_sub_dirs(doc)
+            doc_page = self.conf.shard.select('pos', catalog.list_sub_dirs(doc), key=page_key)
             for page in doc_page:
-                txt_files = walk_dir(page, file_type='txt')
-                for txt in txt_files:
+                txt_files = catalog.walk_dir(page, file_type='txt')
+                if not txt_files:
+                    self.conf.shard.skipped('pos', page_key(page))
+                    continue
+                names = [self.__result_name(txt) for txt in txt_files]
+                digest = None
+                if cache:
+                    digest = cache.outdated(cache.key(page), txt_files,
+                                            pos_output_files(page, names, self.conf.pos_format))
+                    if not digest:
+                        self.conf.shard.skipped('pos', page_key(page))
+                        continue
+                if sum(len(files) for __, __, files, __ in batches[-1]) >= batch_size:
+                    batches.append([])
+                batches[-1].append((page, digest, txt_files, names))
+        batches = [batch for batch in batches if batch]
+
+        try:
+            if self.conf.jobs > 1:
+                self.__tag_batches_parallel(batches, cache)
+            else:
+                for batch in batches:
+                    txt_files = [txt for __, __, files, __ in batch for txt in files]
                     if self.conf.verbose:
-                        print("   ... " + txt + " ... ")
-                    fname = os.path.basename(txt)
-                    # Overwrite file, if exists.
-                    if 'pos' in fname:
-                        # Truncate _pos.txt
-                        fname = fname[:-8]
-                    else:
-                        # Truncate .txt
-                        fname = str(fname.split('.')[0])
-                    json_obj = self.__tag_file_tree_tagger(txt, self.conf.lang, tree_tagger_dir='')
-                    dump_obj_to_json(page, fname + '_pos' + '.json', json_obj)
+                        for txt in txt_files:
+                            print("   ... " + txt + " ... ")
+                    with self.conf.metrics.item():
+                        json_objs = self.tag_files(txt_files, self.conf.lang)
+                    self.__write_batch(batch, json_objs, cache)
+        finally:
+            if cache:
+                cache.save()
         if self.conf.verbose:
             print("++++++++++++++++++++++")
 
     def run(self) -> None:
         try:
-            self.__tag_file_stack()
+            with self.conf.metrics.stage('pos'):
+                self.__tag_file_stack()
         except KeyboardInterrupt:
             print("\nComputation cancelled.")
+
+
+# POSProcessor of a worker process, started on its first batch and kept until the pool shuts down.
+_worker_processor = None
+
+
+def _tag_files_worker(conf, txt_files: list) -> tuple:
+    """
+    Entry point for worker processes of POSProcessor.
+    Returns the results and the metrics of the batch.
+    """
+    global _worker_processor
+    if _worker_processor is None:
+        _worker_processor = POSProcessor(conf)
+    with conf.metrics.item():
+        json_objs = _worker_processor.tag_files(txt_files, conf.lang)
+    return json_objs, conf.metrics.export()
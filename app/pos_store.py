@@ -0,0 +1,135 @@
+# coding=utf-8
+
+
+"""
+Writes and reads pos tagging results of a page directory.
+
+Three formats are supported:
+    json:     one indented json file per text file, name_pos.json (default).
+    jsonl:    one pos.jsonl per page, one line per text file with
+              [word, pos, lemma] triples.
+    columnar: one pos.columns.json per page with interned strings and
+              word, pos and lemma id arrays per text file.
+All formats are read back into the same records: lists of
+{'word': ..., 'pos': ..., 'lemma': ...} dictionaries.
+"""
+
+import json
+from os import listdir
+from os import remove
+from os.path import exists
+from os.path import join
+
+from .util import dump_obj_to_json
+from .util import list_sub_dirs
+from .util import natural_keys
+from .util import read_json_to_obj
+
+
+pos_formats = ('json', 'jsonl', 'columnar')
+
+json_suffix = '_pos.json'
+jsonl_name = 'pos.jsonl'
+columnar_name = 'pos.columns.json'
+
+
+def pos_output_files(page_dir: str, names: list, pos_format: str) -> list:
+    """
+    Returns the files written for the text files names of a page.
+    """
+    if pos_format == 'jsonl':
+        return [join(page_dir, jsonl_name)]
+    if pos_format == 'columnar':
+        return [join(page_dir, columnar_name)]
+    return [join(page_dir, name + json_suffix) for name in names]
+
+
+def page_pos_files(page_dir: str) -> list:
+    """
+    Returns the pos result files of a page in any format.
+    """
+    if not exists(page_dir):
+        return []
+    return [join(page_dir, file_name) for file_name in sorted(listdir(page_dir), key=natural_keys)
+            if file_name in (jsonl_name, columnar_name) or file_name.endswith(json_suffix)]
+
+
+def write_pos_results(page_dir: str, results: list, pos_format: str) -> bool:
+    """
+    Writes (name, records) pairs of all text files of a page.
+    Existing results of the page are replaced, also those of another format,
+    so that a page is never read back from results of two runs.
+    """
+    if pos_format not in pos_formats:
+        raise Exception('Unknown pos format: {0}'.format(pos_format))
+
+    for path in page_pos_files(page_dir):
+        remove(path)
+
+    if pos_format == 'json':
+        for name, records in results:
+            dump_obj_to_json(page_dir, name + json_suffix, records)
+        return True
+
+    if pos_format == 'jsonl':
+        with open(join(page_dir, jsonl_name), mode='w', encoding='utf-8') as fp:
+            for name, records in results:
+                tokens = [[r['word'], r['pos'], r['lemma']] for r in records]
+                fp.write(json.dumps({'name': name, 'tokens': tokens},
+                                    ensure_ascii=False, separators=(',', ':')))
+                fp.write('\n')
+        return True
+
+    strings = {}
+    files = []
+    for name, records in results:
+        files.append({'name': name,
+                      'word': [strings.setdefault(r['word'], len(strings)) for r in records],
+                      'pos': [strings.setdefault(r['pos'], len(strings)) for r in records],
+                      'lemma': [strings.setdefault(r['lemma'], len(strings)) for r in records]})
+    with open(join(page_dir, columnar_name), mode='w', encoding='utf-8') as fp:
+        json.dump({'strings': list(strings), 'files': files}, fp,
+                  ensure_ascii=False, separators=(',', ':'))
+    return True
+
+
+def read_pos_results(page_dir: str) -> dict:
+    """
+    Loads the pos results of a page in any format.
+    Returns a dictionary of text file name to records.
+    """
+    results = {}
+
+    columnar_path = join(page_dir, columnar_name)
+    if exists(columnar_path):
+        obj = read_json_to_obj(columnar_path)
+        strings = obj['strings']
+        for one_file in obj['files']:
+            results[one_file['name']] = [{'word': strings[w], 'pos': strings[p], 'lemma': strings[l]}
+                                         for w, p, l in zip(one_file['word'], one_file['pos'], one_file['lemma'])]
+
+    jsonl_path = join(page_dir, jsonl_name)
+    if exists(jsonl_path):
+        with open(jsonl_path, mode='r', encoding='utf-8') as fp:
+            for line in fp:
+                if not line.strip():
+                    continue
+                obj = json.loads(line)
+                results[obj['name']] = [{'word': w, 'pos': p, 'lemma': l} for w, p, l in obj['tokens']]
+
+    for file_name in sorted(listdir(page_dir), key=natural_keys):
+        if file_name.endswith(json_suffix):
+            results.setdefault(file_name[:-len(json_suffix)], read_json_to_obj(join(page_dir, file_name)))
+
+    return results
+
+
+def iter_pos_results(in_dir: str):
+    """
+    Yields (page_dir, results) for all pages of all documents in in_dir.
+    """
+    for doc in list_sub_dirs(in_dir):
+        for page in list_sub_dirs(doc):
+            results = read_pos_results(page)
+            if results:
+                yield page, results
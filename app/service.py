@@ -0,0 +1,184 @@
+# coding=utf-8
+
+
+"""
+Long-running processing service with a localhost HTTP API.
+"""
+
+import json
+import logging
+from collections import OrderedDict
+from collections import deque
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from queue import Queue
+from socketserver import ThreadingMixIn
+from threading import Event
+from threading import Lock
+from threading import Thread
+
+from .pipeline import Pipeline
+from .pipeline import process_order
+
+
+default_port = 8765
+
+# Finished jobs kept for status requests, older ones are dropped.
+max_finished_jobs = 1000
+
+
+class Service:
+    """
+    Keeps the Config and the processors of a run warm and runs jobs on them.
+
+    A job lists its stages and the tree to process, like run.py:
+        {'stages': ['image', 'ocr'], 'in_dir': ..., 'out_dir': ...}
+    It may be restricted to a single pdf, page image or crop (page) directory:
+        {'stages': [...], 'page': '/tree/vol1/12.png'}
+    in_dir and out_dir then default to the tree of that document.
+
+    Jobs run one at a time in a background thread, in the order they were
+    submitted, on one Pipeline. Parameters, loaded modules, the directory
+    listings and the TreeTagger processes are kept between jobs. The result
+    of a job is that of Pipeline.run(), it can be looked up until
+    max_finished_jobs later jobs have finished.
+    """
+
+    def __init__(self, conf):
+        self.conf = conf
+        self.pipeline = Pipeline(conf)
+        self.jobs = OrderedDict()
+        self.finished = deque()
+        self.submitted = 0
+        self.queue = Queue()
+        self.running = None
+        self.__events = {}
+        self.__lock = Lock()
+        self.__worker = Thread(target=self.__run_jobs, daemon=True)
+        self.__worker.start()
+
+    @staticmethod
+    def source(job: dict) -> dict:
+        """
+        Arguments of Pipeline.run for the tree, pdf, page or crops of a job.
+        """
+        return {name: job.get(name) for name in ('in_dir', 'out_dir', 'pdf', 'page', 'crops')}
+
+    def submit(self, job: dict) -> dict:
+        stages = job.get('stages')
+        if not stages or any(stage not in process_order for stage in stages):
+            raise Exception('Job needs stages out of {0}: {1}'.format(', '.join(process_order), stages))
+        Pipeline.scope(**self.source(job))
+        with self.__lock:
+            self.submitted += 1
+            job_id = str(self.submitted)
+            self.jobs[job_id] = {'id': job_id, 'status': 'queued', 'job': job}
+            self.__events[job_id] = Event()
+        self.queue.put(job_id)
+        return self.status(job_id)
+
+    def status(self, job_id: str) -> dict:
+        with self.__lock:
+            if job_id not in self.jobs:
+                return None
+            return dict(self.jobs[job_id])
+
+    def wait(self, job_id: str, timeout=None) -> dict:
+        event = self.__events.get(job_id)
+        if event is not None:
+            event.wait(timeout)
+        return self.status(job_id)
+
+    def __run_jobs(self):
+        while True:
+            job_id = self.queue.get()
+            with self.__lock:
+                record = self.jobs[job_id]
+                record['status'] = 'running'
+                self.running = job_id
+            try:
+                result = self.pipeline.run(stages=record['job']['stages'], **self.source(record['job']))
+            except Exception as e:
+                logging.error("Could not run job {0}: {1}".format(job_id, repr(e)))
+                result = {'status': 'failed', 'errors': [{'stage': None, 'error': repr(e)}]}
+            with self.__lock:
+                record.update(result)
+                self.running = None
+                self.finished.append(job_id)
+                while len(self.finished) > max_finished_jobs:
+                    old_id = self.finished.popleft()
+                    del self.jobs[old_id]
+                    self.__events.pop(old_id).set()
+            self.__events[job_id].set()
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    GET  /status         state of the service
+    GET  /jobs/<id>      state and result of a job
+    POST /jobs           submits the job in the json body, waits for it with {'wait': true}
+    POST /shutdown       stops the service
+    """
+
+    service = None
+
+    def __reply(self, code: int, obj: object) -> None:
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.service
+        if self.path == '/status':
+            return self.__reply(200, {'jobs': service.submitted,
+                                      'queued': service.queue.qsize(),
+                                      'running': service.running})
+        if self.path.startswith('/jobs/'):
+            record = service.status(self.path[len('/jobs/'):])
+            if record is None:
+                return self.__reply(404, {'error': 'Unknown job'})
+            return self.__reply(200, record)
+        return self.__reply(404, {'error': 'Unknown path'})
+
+    def do_POST(self):
+        if self.path == '/shutdown':
+            self.__reply(200, {'status': 'stopping'})
+            Thread(target=self.server.shutdown, daemon=True).start()
+            return
+        if self.path != '/jobs':
+            return self.__reply(404, {'error': 'Unknown path'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = json.loads(self.rfile.read(length).decode('utf-8'))
+            record = self.service.submit(job)
+        except Exception as e:
+            return self.__reply(400, {'error': repr(e)})
+        if job.get('wait'):
+            record = self.service.wait(record['id'])
+        return self.__reply(200, record)
+
+    def log_message(self, format, *args):
+        if self.service.conf.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+def serve(conf, port=default_port, host='127.0.0.1') -> None:
+    """
+    Runs the service on host:port until it is shut down.
+    Only localhost is served by default, jobs name arbitrary paths.
+    """
+    handler = type('Handler', (_Handler,), {'service': Service(conf)})
+    server = _Server((host, port), handler)
+    if conf.verbose:
+        print("### Serving on http://{0}:{1} ###".format(host, port))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
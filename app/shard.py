@@ -0,0 +1,150 @@
+# coding=utf-8
+
+
+"""
+Deterministic split of the work items of a run across several nodes.
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from os.path import basename
+from os.path import dirname
+from os.path import join
+from os.path import normpath
+from os.path import splitext
+from threading import Lock
+
+
+def shard_of(key: str, count: int) -> int:
+    """
+    Shard of a work item, from a hash of its key that is the same on every node and run.
+    """
+    return int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:15], 16) % count
+
+
+def page_key(page_dir: str) -> str:
+    """
+    Key of a page, e.g. 'vol1/12', from its directory or its page image.
+    """
+    page_dir = normpath(page_dir)
+    return basename(dirname(page_dir)) + '/' + basename(page_dir).split('.')[0]
+
+
+class Shard:
+    """
+    Part index of count of the work items of every stage.
+
+    Pages are assigned by the hash of their key 'document/page', the pdf
+    stage assigns whole documents. The assignment only depends on the
+    names, so every node computes the same split of a shared or copied tree.
+
+    Stages select their work items with select() and report the ones
+    they skipped as current (incremental runs) or processed. The report
+    is checked and combined with those of the other shards by merge_shards.py.
+    The default shard 0 of 1 owns everything. With keys, it owns only
+    those pages and the pages of those documents, e.g. {'vol1/12', 'vol2'}.
+    Worker processes get a copy without the records.
+    """
+
+    def __init__(self, index=0, count=1, keys=None):
+        if count < 1 or not 0 <= index < count:
+            raise Exception('Invalid shard {0}/{1}'.format(index, count))
+        self.index = index
+        self.count = count
+        self.keys = set(keys) if keys is not None else None
+        self.stages = OrderedDict()
+        self.__lock = Lock()
+
+    def __getstate__(self):
+        return {'index': self.index, 'count': self.count, 'keys': self.keys}
+
+    def __setstate__(self, state):
+        self.__init__(state['index'], state['count'], state['keys'])
+
+    @staticmethod
+    def parse(text: str):
+        """
+        Shard from 'i/N', with 0 <= i < N.
+        """
+        try:
+            index, count = text.split('/')
+            return Shard(int(index), int(count))
+        except ValueError:
+            raise Exception('Shard must be given as i/N: {0}'.format(text))
+
+    @property
+    def name(self) -> str:
+        return '{0}-of-{1}'.format(self.index, self.count)
+
+    def __stage(self, stage: str) -> dict:
+        return self.stages.setdefault(stage, {'total': 0, 'owned': [], 'skipped': [], 'done': []})
+
+    def owns(self, key: str) -> bool:
+        if self.keys is not None and key not in self.keys and key.split('/')[0] not in self.keys:
+            return False
+        return self.count == 1 or shard_of(key, self.count) == self.index
+
+    def select(self, stage: str, items: list, key) -> list:
+        """
+        Returns the items of stage that belong to this shard, key gives the key of an item.
+        Only the first stage of a run records the total number of items.
+        """
+        owned = [item for item in items if self.owns(key(item))]
+        with self.__lock:
+            entry = self.__stage(stage)
+            # After an earlier stage of the run, the items are output that other
+            # shards may still be writing, so their number differs between shards.
+            if any(name != stage for name in self.stages):
+                entry['total'] = None
+            if entry['total'] is not None:
+                entry['total'] += len(items)
+            entry['owned'].extend(key(item) for item in owned)
+        return owned
+
+    def own(self, stage: str, key: str) -> None:
+        """
+        Adds a work item of stage that was found only while processing, e.g. a
+        page of a pdf of this shard. The total of the stage is then unknown.
+        """
+        with self.__lock:
+            entry = self.__stage(stage)
+            entry['total'] = None
+            entry['owned'].append(key)
+
+    def skipped(self, stage: str, key: str) -> None:
+        with self.__lock:
+            self.__stage(stage)['skipped'].append(key)
+
+    def done(self, stage: str, key: str) -> None:
+        with self.__lock:
+            self.__stage(stage)['done'].append(key)
+
+    def file_name(self, file_name: str) -> str:
+        """
+        Name of a file every shard keeps for itself, like build manifests and
+        crop containers, so that shards never write the same file.
+        """
+        if self.count == 1:
+            return file_name
+        stem, ext = splitext(file_name)
+        return stem + '.' + self.name + ext
+
+    def report_path(self, out_dir: str) -> str:
+        return join(out_dir, '.shard-' + self.name + '.json')
+
+    def dump(self, out_dir: str, metrics=None) -> str:
+        """
+        Writes the work items and the metrics of this shard to out_dir.
+        Returns the path of the report.
+        """
+        path = self.report_path(out_dir)
+        report = {'shard': [self.index, self.count],
+                  'stages': self.stages,
+                  'metrics': metrics.report() if metrics is not None else None}
+        try:
+            with open(path, mode='w', encoding='utf-8') as fp:
+                json.dump(report, fp, separators=(',', ':'))
+        except Exception as e:
+            raise Exception("Could not write shard report {0}: {1}".format(path, repr(e)))
+        return path
@@ -0,0 +1,215 @@
+# coding=utf-8
+
+
+"""
+Streams single pages through all processing stages in memory.
+"""
+
+import logging
+from functools import partial
+from os import makedirs
+from os.path import basename
+from os.path import join
+from queue import Queue
+from threading import Thread
+
+from .pipeline import Pipeline
+from .pipeline import check_requires
+from .pipeline import page_stages
+from .pos_store import write_pos_results
+from .shard import page_key
+from .util import read_page
+
+from app.config import Config
+
+
+# Marks the end of the page stream in a queue.
+_END = None
+
+
+class StreamProcessor:
+    """
+    Runs pdf -> image -> chronicle -> ocr -> pos for one page at a time.
+
+    Every stage runs in its own thread and passes pages as in-memory arrays
+    and text to the next stage through a bounded queue. Only the output of
+    the last stage is written to disk, unless conf.stream_keep asks for more.
+    """
+
+    stage_order = ('pdf', 'image', 'chronicle', 'ocr', 'pos')
+
+    def __init__(self, conf, stages):
+        if not isinstance(conf, Config) or not conf:
+            raise TypeError('Need instance of Config class!')
+        self.conf = conf
+
+        stages = tuple(stage for stage in StreamProcessor.stage_order if stage in stages)
+        if not stages or stages[0] not in ('pdf', 'image'):
+            raise Exception('Streaming has to start with pdf or image stage: {0}'.format(stages))
+        check_requires(stages)
+        self.stages = stages
+        # Runs the page stages, the same way as Pipeline.process().
+        self.pipeline = Pipeline(conf, stages)
+
+    def __pdf_pages(self):
+        pdf_processor = self.pipeline.processor('pdf')
+        pdf_files = self.conf.catalog.walk_dir(self.conf.in_dir, file_type='pdf')
+        if not pdf_files:
+            raise Exception('No PDF files found in: {0}'.format(self.conf.in_dir))
+        # Documents are split between shards as a whole, their pages are only known once rendered.
+        shard = self.conf.shard
+        for pdf_path in shard.select('pdf', pdf_files, key=lambda pdf_path: basename(pdf_path).split('.')[0]):
+            doc = basename(pdf_path).split('.')[0]
+            # A failed document is counted and skipped, the following ones are still streamed.
+            try:
+                for page_no, page in pdf_processor.iter_pages(pdf_path):
+                    shard.own('stream', doc + '/' + page_no)
+                    yield {'doc': doc, 'page_no': page_no, 'page': page}
+            except Exception as e:
+                self.conf.metrics.count('errors')
+                logging.error("Could not read pages of {0}: {1}".format(pdf_path, repr(e)))
+                continue
+            shard.done('pdf', doc)
+
+    def __image_pages(self):
+        catalog = self.conf.catalog
+        catalog.scan(self.conf.in_dir, depth=1)
+        dirs = catalog.list_sub_dirs(self.conf.in_dir)
+        if not dirs:
+            raise Exception('Path tree seems to invalid in: {0}. Path has different structure'.format(self.conf.in_dir))
+        for d in dirs:
+            for image_path in self.conf.shard.select('stream', catalog.walk_dir(d, self.conf.image_type), key=page_key):
+                # An unreadable page is counted and skipped, the following ones are still streamed.
+                try:
+                    page = read_page(image_path, self.conf.pixel_type)
+                except Exception as e:
+                    self.conf.metrics.count('errors')
+                    logging.error("Could not read page {0}: {1}".format(image_path, repr(e)))
+                    continue
+                yield {'doc': basename(d),
+                       'page_no': str(basename(image_path).split('.')[0]),
+                       'page': page}
+
+    def __write(self, item: dict) -> bool:
+        """
+        Writes the results of a page in the same tree as the stage-by-stage processing.
+        """
+        from skimage import io
+
+        write = set(self.conf.stream_keep) | {self.stages[-1]}
+        doc_dir = join(self.conf.out_dir, item['doc'])
+        page_dir = join(doc_dir, item['page_no'])
+        makedirs(doc_dir, exist_ok=True)
+
+        if 'pdf' in write:
+            io.imsave(join(doc_dir, item['page_no'] + '.' + self.conf.image_type), item['page'])
+
+        if write & {'image', 'chronicle'}:
+            # Counts the crops it saves.
+            self.pipeline.processor('image').save_page(item['page'], item['boxes'], doc_dir, item['page_no'],
+                                                       self.conf.image_type, names=item['names'])
+        elif 'boxes' in item:
+            self.conf.metrics.count('crops', len(item['boxes']))
+
+        if 'ocr' in write:
+            makedirs(page_dir, exist_ok=True)
+            for name, text in zip(item['names'], item['texts']):
+                with open(join(page_dir, name + '.txt'), mode='w', encoding='utf-8') as fp:
+                    fp.write(text)
+
+        if 'pos' in write:
+            makedirs(page_dir, exist_ok=True)
+            write_pos_results(page_dir, list(zip(item['names'], item['tags'])), self.conf.pos_format)
+
+        # The document is listed again at its next lookup.
+        self.conf.catalog.add_dir(doc_dir)
+        return True
+
+    @staticmethod
+    def __source_worker(pages, q_out: Queue):
+        try:
+            for item in pages:
+                q_out.put(item)
+        except Exception as e:
+            logging.error("Could not read pages: {0}".format(repr(e)))
+        finally:
+            q_out.put(_END)
+
+    @staticmethod
+    def __stage_worker(stage, q_in: Queue, q_out: Queue, metrics):
+        while True:
+            item = q_in.get()
+            if item is _END:
+                q_out.put(_END)
+                break
+            try:
+                # Every stage of a page is measured as one item, in the thread of the stage.
+                with metrics.item():
+                    item = stage(item)
+                q_out.put(item)
+            except Exception as e:
+                metrics.count('errors')
+                logging.error("Could not process page {0}/{1}: {2}".format(item['doc'], item['page_no'], repr(e)))
+
+    def __process_stream(self) -> int:
+        if self.conf.verbose:
+            print("++ Stream Processor ++")
+            print("   Streaming " + ", ".join(self.stages) + " in path " + self.conf.in_dir)
+
+        # Processors are created up front, the stage threads only use them.
+        self.pipeline.processor('image')
+        stages = []
+        for stage in self.stages:
+            if stage in page_stages:
+                self.pipeline.processor(stage)
+                stages.append(partial(self.pipeline.process_stage, stage))
+
+        pages = self.__pdf_pages() if 'pdf' in self.stages else self.__image_pages()
+
+        queues = [Queue(maxsize=self.conf.stream_queue_size) for __ in range(len(stages) + 1)]
+        threads = [Thread(target=self.__source_worker, args=(pages, queues[0]), daemon=True)]
+        for stage, q_in, q_out in zip(stages, queues[:-1], queues[1:]):
+            threads.append(Thread(target=self.__stage_worker, args=(stage, q_in, q_out, self.conf.metrics),
+                                  daemon=True))
+        for thread in threads:
+            thread.start()
+
+        pages_done = 0
+        while True:
+            item = queues[-1].get()
+            if item is _END:
+                break
+            try:
+                self.__write(item)
+            except Exception as e:
+                self.conf.metrics.count('errors')
+                logging.error("Could not write page {0}/{1}: {2}".format(item['doc'], item['page_no'], repr(e)))
+                continue
+            pages_done += 1
+            self.conf.shard.done('stream', item['doc'] + '/' + item['page_no'])
+            self.conf.metrics.count('pages')
+            if 'tags' in item:
+                self.conf.metrics.count('tokens', sum(len(tags) for tags in item['tags']))
+            if self.conf.verbose:
+                print("    ... " + join(item['doc'], item['page_no']) + " ... ")
+
+        for thread in threads:
+            thread.join()
+
+        # Stops the writer threads too, they are not needed after the stream.
+        self.conf.metrics.count('errors', len(self.pipeline.processor('image').close_crops()))
+
+        if self.conf.verbose:
+            print("++++++++++++++++++++++")
+
+        return pages_done
+
+    def run(self) -> None:
+        try:
+            with self.conf.metrics.stage('stream'):
+                self.__process_stream()
+        except KeyboardInterrupt:
+            print("\nComputation cancelled.")
+        finally:
+            if 'image' in self.pipeline.processors:
+                self.pipeline.processor('image').close_crops()
@@ -0,0 +1,117 @@
+# coding=utf-8
+
+
+"""
+Generates synthetic pages with text-like blocks and known text boxes.
+
+A page mimics the layout of the chronicle: a full width text block on top,
+two text columns below and full width footnotes at the bottom.
+Pages are uint8 grey scale images, white (255) paper with black (0) ink,
+like the pages rendered by Ghostscript.
+"""
+
+import numpy as np
+
+
+# Page geometry in inches (A4).
+page_width_in = 8.27
+page_height_in = 11.69
+margin_in = 0.8
+block_gap_in = 0.4
+column_gap_in = 0.5
+
+
+def _text_lines(page: np.ndarray, rng, top: int, left: int, right: int, n_lines: int,
+                line_height: int, ink_height: int, dpi: int) -> int:
+    """
+    Draws n_lines of words between left and right, starting at top.
+    Returns the bottom of the last line.
+    """
+    bottom = top
+    for line in range(n_lines):
+        y = top + line * line_height
+        # The last line of a paragraph may be short.
+        line_right = right if line < n_lines - 1 else left + int((right - left) * rng.uniform(0.3, 1.0))
+        x = left
+        while x < line_right:
+            word_width = min(int(dpi * rng.uniform(0.15, 0.6)), line_right - x)
+            if word_width < 2:
+                break
+            word = rng.random_sample((ink_height, word_width)) < 0.55
+            page[y:y + ink_height, x:x + word_width][word] = 0
+            x += word_width + int(dpi * 0.06)
+        bottom = y + ink_height
+    return bottom
+
+
+def make_page(dpi=150, seed=0, columns=True, footnotes=True) -> tuple:
+    """
+    Generates a synthetic page at the given resolution.
+
+    Returns the page and its ground truth text boxes as list of
+    {'kind': ..., 'box': [top, bottom, left, right]} dictionaries, where kind
+    is one of political, misc, eccles and footnotes.
+    """
+    rng = np.random.RandomState(seed)
+
+    height, width = int(page_height_in * dpi), int(page_width_in * dpi)
+    page = np.full((height, width), 255, dtype=np.uint8)
+
+    margin = int(margin_in * dpi)
+    block_gap = int(block_gap_in * dpi)
+    line_height, ink_height = int(0.16 * dpi), int(0.1 * dpi)
+    left, right = margin, width - margin
+
+    boxes = []
+
+    top = margin
+    bottom = _text_lines(page, rng, top, left, right, rng.randint(6, 12), line_height, ink_height, dpi)
+    boxes.append({'kind': 'political', 'box': [top, bottom, left, right]})
+    top = bottom + block_gap
+
+    if columns:
+        column_gap = int(column_gap_in * dpi)
+        middle = (left + right) // 2
+        column_bottom = top
+        for kind, col_left, col_right in (('misc', left, middle - column_gap // 2),
+                                          ('eccles', middle + column_gap // 2, right)):
+            bottom = _text_lines(page, rng, top, col_left, col_right, rng.randint(10, 20),
+                                 line_height, ink_height, dpi)
+            boxes.append({'kind': kind, 'box': [top, bottom, col_left, col_right]})
+            column_bottom = max(column_bottom, bottom)
+        top = column_bottom + block_gap
+
+    if footnotes:
+        bottom = _text_lines(page, rng, top, left, right, rng.randint(3, 6),
+                             int(0.12 * dpi), int(0.07 * dpi), dpi)
+        boxes.append({'kind': 'footnotes', 'box': [top, bottom, left, right]})
+
+    return page, boxes
+
+
+def box_iou(box_a, box_b) -> float:
+    """
+    Intersection over union of two (top, bottom, left, right) boxes.
+    """
+    top, bottom = max(box_a[0], box_b[0]), min(box_a[1], box_b[1])
+    left, right = max(box_a[2], box_b[2]), min(box_a[3], box_b[3])
+    intersection = max(0, bottom - top) * max(0, right - left)
+    area_a = (box_a[1] - box_a[0]) * (box_a[3] - box_a[2])
+    area_b = (box_b[1] - box_b[0]) * (box_b[3] - box_b[2])
+    union = area_a + area_b - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def box_agreement(truth: list, detected: list, min_iou=0.5) -> dict:
+    """
+    Compares ground truth boxes with detected boxes.
+
+    Every ground truth box is matched with the detected box of highest overlap.
+    Returns the mean of those overlaps, the share of ground truth boxes
+    matched with at least min_iou, and the number of boxes.
+    """
+    best = [max([box_iou(t['box'], d) for d in detected] or [0.0]) for t in truth]
+    return {'mean_iou': sum(best) / len(best) if best else 0.0,
+            'recall': sum(1 for iou in best if iou >= min_iou) / len(best) if best else 0.0,
+            'truth_boxes': len(truth),
+            'detected_boxes': len(detected)}
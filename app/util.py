@@ -5,22 +5,32 @@
 Module for basic operations on directories.
 """
 
+import re
 from os import remove
 from os import rmdir
+from os import scandir
 from os import walk
 from os.path import exists
 from os.path import join
 
 
+# File name of the layout manifest in each page directory.
+layout_manifest_name = 'layout.json'
+
+# Splits names into text and numbers for natural sorting.
+_digits = re.compile(r'(\d+)')
+
+
 def walk_dir(path: str, file_type: str) -> list:
     """
     Walks directory to find all files with given file type extension.
     """
     try:
-        __, __, file_names = next(walk(path), (None, None, []))
-        file_paths = [join(path, a_file) for a_file in file_names
-                      if a_file.endswith(file_type)]
-        return sorted(file_paths, key=natural_keys)
+        file_names = [entry.name for entry in scandir(path)
+                      if entry.name.endswith(file_type) and not entry.is_dir()]
+        return [join(path, a_file) for a_file in sorted(file_names, key=natural_keys)]
+    except FileNotFoundError:
+        return []
     except Exception as e:
         raise Exception("Could not read {0}: {1}".format(path, repr(e)))
 
@@ -31,9 +41,10 @@ def list_sub_dirs(path: str) -> list:
     Returns absolute paths of directories.
     """
     try:
-        __, ls_dir, __ = next(walk(path), (None, None, []))
-        ls_dir[:] = [join(path, entry) for entry in ls_dir]
-        return sorted(ls_dir, key=natural_keys)
+        ls_dir = [entry.name for entry in scandir(path) if entry.is_dir()]
+        return [join(path, entry) for entry in sorted(ls_dir, key=natural_keys)]
+    except FileNotFoundError:
+        return []
     except Exception as e:
         raise Exception("Could not read {0}: {1}".format(path, repr(e)))
 
@@ -142,11 +153,144 @@ def read_json_to_obj(file_path: str) -> bool:
         raise Exception("Could not make json file: {0}.".format(repr(e)))
 
 
+def read_layout_manifest(page_dir: str) -> dict:
+    """
+    Loads the layout manifest of a page directory.
+    Returns None, if the page has no manifest.
+    """
+    obj = read_json_to_obj(join(page_dir, layout_manifest_name))
+    return obj if obj else None
+
+
+def dump_layout_manifest(page_dir: str, manifest: dict) -> bool:
+    """
+    Dumps the layout manifest of a page directory.
+    Replaces an existing manifest.
+    Returns True on sucess.
+    """
+    manifest_path = join(page_dir, layout_manifest_name)
+    if exists(manifest_path):
+        remove(manifest_path)
+    return dump_obj_to_json(page_dir, layout_manifest_name, manifest)
+
+
+def grey_uint8(image):
+    """
+    Converts an image to 8 bit grey levels.
+    Colour images are weighted like skimage.color.rgb2grey, 8 bit ones without a float copy.
+    """
+    import numpy as np
+
+    if image.ndim > 2:
+        if image.dtype != np.uint8:
+            from skimage.color import rgb2grey
+            return grey_uint8(rgb2grey(image))
+        # Weights 0.2125, 0.7154, 0.0721 in 1/256, alpha is dropped.
+        grey = image[..., 0].astype(np.uint16) * 54
+        grey += image[..., 1].astype(np.uint16) * 183
+        grey += image[..., 2].astype(np.uint16) * 19
+        grey += 128
+        grey >>= 8
+        return grey.astype(np.uint8)
+    if image.dtype == np.uint8:
+        return image
+    if image.dtype == np.bool_:
+        return image.astype(np.uint8) * 255
+    if image.dtype == np.uint16:
+        return (image >> 8).astype(np.uint8)
+    return np.rint(np.clip(image, 0.0, 1.0) * 255).astype(np.uint8)
+
+
+def _tiff_size(fp, order: str):
+    """
+    Reads ImageWidth and ImageLength from the first IFD of a TIFF file.
+    """
+    import struct
+
+    fp.seek(4)
+    offset, = struct.unpack(order + 'I', fp.read(4))
+    fp.seek(offset)
+    entries, = struct.unpack(order + 'H', fp.read(2))
+    tags = {}
+    for __ in range(entries):
+        tag, value_type, __, value = struct.unpack(order + 'HHI4s', fp.read(12))
+        if tag in (256, 257):
+            # SHORT or LONG values are stored in the entry itself.
+            tags[tag], = struct.unpack(order + ('H2x' if value_type == 3 else 'I'), value)
+    if 256 in tags and 257 in tags:
+        return tags[257], tags[256]
+    return None
+
+
+def image_size(path: str) -> tuple:
+    """
+    Returns (height, width) of an image without decoding its pixels.
+
+    PNG (IHDR) and TIFF headers are read directly, npy headers by NumPy,
+    other types are opened lazily by PIL, which reads their header only.
+    """
+    import struct
+
+    try:
+        with open(path, mode='rb') as fp:
+            head = fp.read(24)
+            if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+                width, height = struct.unpack('>II', head[16:24])
+                return height, width
+            if head[:4] in (b'II*\x00', b'MM\x00*'):
+                size = _tiff_size(fp, '<' if head[:2] == b'II' else '>')
+                if size:
+                    return size
+        if path.endswith('.npy'):
+            import numpy as np
+            return tuple(np.load(path, mmap_mode='r').shape[:2])
+
+        from PIL import Image
+        with Image.open(path) as image:
+            width, height = image.size
+        return height, width
+    except Exception as e:
+        raise Exception("Could not read size of {0}: {1}".format(path, repr(e)))
+
+
+def read_page(path: str, pixel_type='float'):
+    """
+    Reads a page image in grey scale.
+
+    pixel_type 'float' reads floats in [0, 1]. io.imread(path, as_grey=True)
+    converts colour images only, grey scale files are converted by img_as_float.
+    'uint8' reads 8 bit grey levels, an eighth of the memory.
+    """
+    from skimage import img_as_float
+    from skimage import io
+
+    if pixel_type == 'float':
+        return img_as_float(io.imread(path, as_grey=True))
+    if pixel_type == 'uint8':
+        return grey_uint8(io.imread(path))
+    raise Exception('Unknown pixel type: {0}'.format(pixel_type))
+
+
+def grey_page(image, pixel_type='float'):
+    """
+    Converts a page image held in memory like read_page converts a page file.
+    """
+    if pixel_type == 'float':
+        from skimage import img_as_float
+
+        if image.ndim > 2:
+            from skimage.color import rgb2grey
+            image = rgb2grey(image)
+        return img_as_float(image)
+    if pixel_type == 'uint8':
+        return grey_uint8(image)
+    raise Exception('Unknown pixel type: {0}'.format(pixel_type))
+
+
 def atoi(text: str) -> int or str:
     return int(text) if text.isdigit() else text
 
 
 def natural_keys(text: str) -> list:
-    import re
-    return [atoi(c) for c in re.split('(\d+)', text)]
+    return [atoi(c) for c in _digits.split(text)]
 
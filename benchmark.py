@@ -0,0 +1,205 @@
+# coding=utf-8
+
+
+"""
+Benchmarks the layout stages on synthetic pages.
+
+Times in-memory text box detection, the ImageProcessor and the
+ChronicleProcessor on a generated page tree, and the util directory
+helpers. Reports pages/sec, peak memory and agreement of the detected
+boxes with the known ground truth, and compares them with a baseline.
+"""
+
+import argparse
+import json
+import sys
+
+
+parser = argparse.ArgumentParser(prog='PDFCrop benchmark')
+
+parser.add_argument('--pages', help='Number of synthetic pages.', type=int, default=10)
+parser.add_argument('--dpi', help='Resolution of the synthetic pages.', type=int, default=150)
+parser.add_argument('--engine', help='Text box detection engine.', choices=('numpy', 'python', 'pyramid'),
+                    default='numpy')
+parser.add_argument('--pixel_type', help='Pixel type of loaded pages.', choices=('float', 'uint8'), default='float')
+parser.add_argument('--repeat', help='Runs per stage, the fastest one counts.', type=int, default=3)
+parser.add_argument('--work_dir', help='Directory for the page tree, a temporary one by default.')
+parser.add_argument('--baseline', help='Baseline json file.', default='bench_baseline.json')
+parser.add_argument('--save_baseline', help='Store the results as new baseline.', action='store_true')
+parser.add_argument('--tolerance', help='Allowed relative growth of run time and peak memory.', type=float, default=0.25)
+parser.add_argument('--output', help='Write the report to this json file.')
+
+
+def measure(func, repeat: int) -> dict:
+    """
+    Runs func repeat times and once more under tracemalloc.
+    Returns the fastest wall time and the peak of traced memory.
+    """
+    import tracemalloc
+    from time import perf_counter
+
+    seconds = []
+    for __ in range(max(1, repeat)):
+        start = perf_counter()
+        func()
+        seconds.append(perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        __, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'seconds': min(seconds), 'peak_mb': peak / float(1 << 20)}
+
+
+def make_tree(work_dir: str, pages: list) -> str:
+    """
+    Writes the synthetic pages into the directory layout of the pdf stage.
+    """
+    from os import makedirs
+    from os.path import join
+
+    from skimage import io
+
+    doc_dir = join(work_dir, 'synthetic')
+    makedirs(doc_dir, exist_ok=True)
+    for page_no, (page, __) in enumerate(pages, 1):
+        io.imsave(join(doc_dir, str(page_no) + '.png'), page)
+    return work_dir
+
+
+def run_benchmarks(args, work_dir: str) -> dict:
+    from app.chronicle_processor import ChronicleProcessor
+    from app.config import Config
+    from app.layout_processor import ImageProcessor
+    from app.synthetic_pages import box_agreement
+    from app.synthetic_pages import make_page
+    from app.util import list_sub_dirs
+    from app.util import walk_dir
+
+    pages = [make_page(dpi=args.dpi, seed=seed) for seed in range(args.pages)]
+    make_tree(work_dir, pages)
+
+    conf = Config(in_dir=work_dir,
+                  out_dir=work_dir,
+                  lang='fra',
+                  dpi=str(args.dpi),
+                  image_type='png')
+    conf.text_box_engine = args.engine
+    conf.pixel_type = args.pixel_type
+    image_processor = ImageProcessor(conf)
+
+    results = {}
+
+    detected = []
+
+    def detect():
+        detected[:] = [image_processor.text_boxes(page) for page, __ in pages]
+
+    results['detect'] = measure(detect, args.repeat)
+    agreements = [box_agreement(truth, boxes) for (__, truth), boxes in zip(pages, detected)]
+    results['detect']['mean_iou'] = sum(a['mean_iou'] for a in agreements) / len(agreements)
+    results['detect']['recall'] = sum(a['recall'] for a in agreements) / len(agreements)
+
+    results['layout'] = measure(ImageProcessor(conf).run, args.repeat)
+    results['chronicle'] = measure(ChronicleProcessor(conf).run, args.repeat)
+
+    def list_tree():
+        for doc in list_sub_dirs(work_dir):
+            walk_dir(doc, 'png')
+            for page in list_sub_dirs(doc):
+                walk_dir(page, 'png')
+
+    results['util'] = measure(list_tree, args.repeat)
+
+    for stage in results.values():
+        stage['pages_per_sec'] = args.pages / stage['seconds'] if stage['seconds'] else float('inf')
+
+    return results
+
+
+def find_regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for stage, base in baseline.items():
+        if stage not in results:
+            continue
+        current = results[stage]
+        # Small absolute slack, timings and traced memory of tiny stages are noisy.
+        if current['seconds'] > base['seconds'] * (1.0 + tolerance) + 0.01:
+            regressions.append('{0}: {1:.2f} pages/sec, baseline {2:.2f}'
+                               .format(stage, current['pages_per_sec'], base['pages_per_sec']))
+        if current['peak_mb'] > base['peak_mb'] * (1.0 + tolerance) + 1.0:
+            regressions.append('{0}: {1:.1f} MB peak memory, baseline {2:.1f}'
+                               .format(stage, current['peak_mb'], base['peak_mb']))
+        for metric in ('mean_iou', 'recall'):
+            if metric in base and current[metric] < base[metric] - 0.01:
+                regressions.append('{0}: {1} {2:.3f}, baseline {3:.3f}'
+                                   .format(stage, metric, current[metric], base[metric]))
+    return regressions
+
+
+def print_report(settings: dict, results: dict) -> None:
+    print("++ Benchmark: {pages} page(s), {dpi} dpi, {engine} engine, {pixel_type} pixels ++".format(**settings))
+    print("   {0:<10} {1:>10} {2:>12} {3:>10} {4:>9} {5:>7}"
+          .format('stage', 'seconds', 'pages/sec', 'peak MB', 'mean IoU', 'recall'))
+    for stage, r in results.items():
+        print("   {0:<10} {1:>10.3f} {2:>12.2f} {3:>10.1f} {4:>9} {5:>7}"
+              .format(stage, r['seconds'], r['pages_per_sec'], r['peak_mb'],
+                      '{0:.3f}'.format(r['mean_iou']) if 'mean_iou' in r else '-',
+                      '{0:.2f}'.format(r['recall']) if 'recall' in r else '-'))
+
+
+def main() -> int:
+    from os.path import exists
+    from tempfile import TemporaryDirectory
+
+    from app.util import read_json_to_obj
+
+    args = parser.parse_args()
+    settings = {'pages': args.pages, 'dpi': args.dpi, 'engine': args.engine, 'pixel_type': args.pixel_type}
+
+    if args.work_dir:
+        results = run_benchmarks(args, args.work_dir)
+    else:
+        with TemporaryDirectory() as work_dir:
+            results = run_benchmarks(args, work_dir)
+
+    print_report(settings, results)
+    report = {'settings': settings, 'results': results}
+
+    if args.output:
+        with open(args.output, mode='w', encoding='utf-8') as fp:
+            json.dump(report, fp, indent=4)
+
+    if args.save_baseline:
+        with open(args.baseline, mode='w', encoding='utf-8') as fp:
+            json.dump(report, fp, indent=4)
+        print("   Baseline saved to " + args.baseline)
+        return 0
+
+    # Without a matching baseline nothing can be checked, which must not pass as success.
+    if not exists(args.baseline):
+        print("   No baseline found in {0}, record one with --save_baseline".format(args.baseline))
+        return 2
+
+    baseline = read_json_to_obj(args.baseline)
+    if baseline['settings'] != settings:
+        print("   Baseline was recorded with other settings: {0}".format(baseline['settings']))
+        return 2
+
+    regressions = find_regressions(results, baseline['results'], args.tolerance)
+    for regression in regressions:
+        print("   REGRESSION " + regression)
+    if regressions:
+        return 1
+    print("   No regressions against " + args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        print("\nComputation cancelled.")
@@ -0,0 +1,104 @@
+# coding=utf-8
+
+
+"""
+Sends jobs to a service started with run.py --serve.
+
+    python client.py --image --chronicle --ocr --page /tree/vol1/12.png
+    python client.py --ocr --crops /tree/vol1/12
+    python client.py --pdf --image --document /in/vol1.pdf --out_dir /tree
+    python client.py --image --ocr --in_dir /tree
+"""
+
+import argparse
+import json
+import sys
+from urllib.error import HTTPError
+from urllib.error import URLError
+from urllib.request import Request
+from urllib.request import urlopen
+
+
+parser = argparse.ArgumentParser(prog='PDFCrop client')
+
+parser.add_argument('--pdf', help='Process pdf files.', action='store_true')
+parser.add_argument('--image', help='Process page images.', action='store_true')
+parser.add_argument('--chronicle', help='Process chronicle of Michael the Syrian.', action='store_true')
+parser.add_argument('--ocr', help='Run Google Tesseract OCR.', action='store_true')
+parser.add_argument('--pos', help='Run POS tagging.', action='store_true')
+
+parser.add_argument('--document', help='Process only this pdf.')
+parser.add_argument('--page', help='Process only this page image.')
+parser.add_argument('--crops', help='Process only this page directory with crops.')
+parser.add_argument('--in_dir', help='Input directory, the tree of the document by default.')
+parser.add_argument('--out_dir', help='Output directory, in_dir by default.')
+
+parser.add_argument('--port', help='Port of the service.', type=int, default=8765)
+parser.add_argument('--no_wait', help='Return after submitting the job.', action='store_true')
+parser.add_argument('--job', help='Print state and result of a submitted job.')
+parser.add_argument('--status', help='Print the state of the service.', action='store_true')
+parser.add_argument('--shutdown', help='Stop the service.', action='store_true')
+parser.add_argument('--json', help='Print the full response.', action='store_true')
+
+process_order = ('pdf', 'image', 'chronicle', 'ocr', 'pos')
+
+
+def request(port: int, path: str, obj=None) -> dict:
+    """
+    Sends a GET, or a POST with obj as json body, to the service.
+    """
+    data = json.dumps(obj).encode('utf-8') if obj is not None else None
+    req = Request('http://127.0.0.1:{0}{1}'.format(port, path), data=data,
+                  headers={'Content-Type': 'application/json'})
+    try:
+        with urlopen(req) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except HTTPError as e:
+        return json.loads(e.read().decode('utf-8'))
+    except URLError as e:
+        raise Exception("Could not reach service on port {0}: {1}".format(port, e.reason))
+
+
+def print_job(record: dict) -> None:
+    print("   job {0}: {1}".format(record.get('id'), record.get('status')))
+    for stage, entry in record.get('stages', {}).items():
+        print("   {0:<10} {1} done, {2} skipped, {3} failed"
+              .format(stage, len(entry['done']), len(entry['skipped']), len(entry['failed'])))
+    for error in record.get('errors', []):
+        print("   ERROR {0}: {1}".format(error['stage'] or 'job', error['error']))
+
+
+def main() -> int:
+    args = parser.parse_args()
+
+    if args.status:
+        response = request(args.port, '/status')
+    elif args.shutdown:
+        response = request(args.port, '/shutdown', {})
+    elif args.job:
+        response = request(args.port, '/jobs/' + args.job)
+    else:
+        stages = [stage for stage in process_order if getattr(args, stage)]
+        if not stages:
+            print('You must specify at least one of the following: pdf, image, chronicle, ocr or pos!')
+            return 1
+        job = {'stages': stages,
+               'pdf': args.document,
+               'page': args.page,
+               'crops': args.crops,
+               'in_dir': args.in_dir,
+               'out_dir': args.out_dir,
+               'wait': not args.no_wait}
+        response = request(args.port, '/jobs', {key: value for key, value in job.items() if value})
+
+    if args.json or 'id' not in response:
+        print(json.dumps(response, indent=4))
+    else:
+        print_job(response)
+    if 'error' in response or response.get('status') == 'failed':
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,197 @@
+# coding=utf-8
+
+
+"""
+Checks and combines the reports of a sharded run.
+
+Every run with --shard i/N writes .shard-i-of-N.json to its output
+directory. The reports of all N shards are checked that every work item
+of every stage belongs to exactly one shard and was processed (or found
+current) by it exactly once, and the metrics of the shards are combined.
+"""
+
+import argparse
+import json
+import sys
+from collections import Counter
+from collections import OrderedDict
+
+
+parser = argparse.ArgumentParser(prog='PDFCrop merge shards')
+
+parser.add_argument('reports', help='Shard reports, or directories with shard reports.', nargs='+')
+parser.add_argument('--output', help='Write the combined metrics and the check to this json file.')
+
+# Stages that process the page directories written by the image stage.
+page_stages = ('chronicle', 'ocr', 'pos')
+
+
+def read_reports(paths: list) -> list:
+    from glob import glob
+    from os.path import isdir
+    from os.path import join
+
+    files = []
+    for path in paths:
+        if isdir(path):
+            files.extend(sorted(glob(join(path, '.shard-*-of-*.json'))))
+        else:
+            files.append(path)
+
+    reports = []
+    for path in files:
+        try:
+            with open(path, mode='r', encoding='utf-8') as fp:
+                reports.append(json.load(fp))
+        except Exception as e:
+            raise Exception("Could not read shard report {0}: {1}".format(path, repr(e)))
+    return reports
+
+
+def verify(reports: list) -> tuple:
+    """
+    Returns the problems found and the number of items per stage.
+    """
+    problems = []
+    counts = {report['shard'][1] for report in reports}
+    if len(counts) != 1:
+        return ['Reports of different shard counts: {0}'.format(sorted(counts))], {}
+    count = counts.pop()
+    indices = Counter(report['shard'][0] for report in reports)
+    for index in range(count):
+        if indices[index] == 0:
+            problems.append('Report of shard {0}/{1} is missing'.format(index, count))
+        elif indices[index] > 1:
+            problems.append('Shard {0}/{1} reported {2} times'.format(index, count, indices[index]))
+
+    stages = OrderedDict()
+    for report in reports:
+        for stage in report['stages']:
+            stages.setdefault(stage, [])
+    for report in reports:
+        for stage, entries in stages.items():
+            if stage not in report['stages']:
+                problems.append('Shard {0}/{1} did not run stage {2}'.format(report['shard'][0], count, stage))
+                continue
+            entries.append((report['shard'][0], report['stages'][stage]))
+
+    # Every page processed or current in the image stage has a page directory,
+    # which the later page stages of the run must have seen.
+    pages = None
+    if 'image' in stages:
+        pages = {key for __, entry in stages['image'] for key in entry['done'] + entry['skipped']}
+
+    items = OrderedDict()
+    for stage, entries in stages.items():
+        owned = Counter(key for __, entry in entries for key in entry['owned'])
+        done = Counter(key for __, entry in entries for key in entry['done'])
+        totals = {entry['total'] for __, entry in entries if entry['total'] is not None}
+
+        if len(totals) > 1:
+            problems.append('{0}: shards saw different inputs, totals {1}'.format(stage, sorted(totals)))
+        elif totals and len(owned) != totals.pop():
+            problems.append('{0}: {1} items owned by the shards, not all of the input'.format(stage, len(owned)))
+        elif not totals and pages is not None and stage in page_stages:
+            for key in sorted(pages - set(owned)):
+                problems.append('{0}: page {1} was not seen by any shard'.format(stage, key))
+        for key, n in sorted(owned.items()):
+            if n > 1:
+                problems.append('{0}: {1} owned by {2} shards'.format(stage, key, n))
+        for key, n in sorted(done.items()):
+            if n > 1:
+                problems.append('{0}: {1} processed {2} times'.format(stage, key, n))
+        for index, entry in entries:
+            missing = set(entry['owned']) - set(entry['done']) - set(entry['skipped'])
+            for key in sorted(missing):
+                problems.append('{0}: {1} of shard {2}/{3} was not processed'.format(stage, key, index, count))
+
+        items[stage] = {'items': len(owned),
+                        'done': len(done),
+                        'skipped': sum(len(entry['skipped']) for __, entry in entries)}
+    return problems, items
+
+
+def merge_metrics(reports: list) -> dict:
+    """
+    Combines the stage metrics of the shards.
+    The shards run side by side: wall time and peak memory are the maxima,
+    cpu time, counters and items add up.
+    """
+    def maximum(values):
+        values = [value for value in values if value is not None]
+        return max(values) if values else None
+
+    stages = OrderedDict()
+    for report in reports:
+        if not report.get('metrics'):
+            continue
+        for name, stage in report['metrics']['stages'].items():
+            stages.setdefault(name, []).append(stage)
+
+    merged = OrderedDict()
+    for name, shard_stages in stages.items():
+        counts = Counter()
+        for stage in shard_stages:
+            counts.update(stage['counts'])
+        wall = maximum(stage['wall_seconds'] for stage in shard_stages)
+        items = [stage['items'] for stage in shard_stages]
+        item_count = sum(item['count'] for item in items)
+        item_seconds = sum(item['count'] * item['mean_seconds'] for item in items if item['count'])
+        cpu_items = [item for item in items if item.get('mean_cpu_seconds') is not None]
+        cpu_count = sum(item['count'] for item in cpu_items)
+        cpu_seconds = sum(item['count'] * item['mean_cpu_seconds'] for item in cpu_items)
+        merged[name] = {'wall_seconds': wall,
+                        'cpu_seconds': round(sum(stage['cpu_seconds'] for stage in shard_stages), 3),
+                        'peak_rss_mb': maximum(stage['peak_rss_mb'] for stage in shard_stages),
+                        'peak_child_rss_mb': maximum(stage['peak_child_rss_mb'] for stage in shard_stages),
+                        'pages_per_sec': round(counts['pages'] / wall, 3) if wall and counts['pages'] else None,
+                        'counts': dict(counts),
+                        'items': {'count': item_count,
+                                  'mean_seconds': round(item_seconds / item_count, 4) if item_count else None,
+                                  'max_seconds': maximum(item['max_seconds'] for item in items),
+                                  'mean_cpu_seconds': round(cpu_seconds / cpu_count, 4) if cpu_count else None,
+                                  'max_cpu_seconds': maximum(item.get('max_cpu_seconds') for item in items),
+                                  'peak_rss_mb': maximum(item.get('peak_rss_mb') for item in items)},
+                        'shards': len(shard_stages)}
+    return merged
+
+
+def main() -> int:
+    args = parser.parse_args()
+    reports = read_reports(args.reports)
+    if not reports:
+        print('No shard reports found in: {0}'.format(', '.join(args.reports)))
+        return 1
+
+    problems, items = verify(reports)
+    merged = merge_metrics(reports)
+
+    print("### Shards ###")
+    print("   {0} report(s) of {1} shard(s)".format(len(reports), reports[0]['shard'][1]))
+    print("   {0:<10} {1:>8} {2:>8} {3:>8} {4:>9} {5:>9}  {6}"
+          .format('stage', 'items', 'done', 'skipped', 'wall s', 'cpu s', 'counts'))
+    for stage, numbers in items.items():
+        metrics = merged.get(stage, {})
+        counts = ', '.join('{0} {1}'.format(k, v) for k, v in sorted(metrics.get('counts', {}).items()))
+        print("   {0:<10} {1:>8} {2:>8} {3:>8} {4:>9} {5:>9}  {6}"
+              .format(stage, numbers['items'], numbers['done'], numbers['skipped'],
+                      '-' if metrics.get('wall_seconds') is None else format(metrics['wall_seconds'], '.2f'),
+                      '-' if metrics.get('cpu_seconds') is None else format(metrics['cpu_seconds'], '.2f'),
+                      counts))
+    for problem in problems:
+        print("   PROBLEM " + problem)
+    if not problems:
+        print("   Every item was processed by exactly one shard.")
+
+    if args.output:
+        with open(args.output, mode='w', encoding='utf-8') as fp:
+            json.dump({'shards': reports[0]['shard'][1],
+                       'stages': merged,
+                       'items': items,
+                       'problems': problems}, fp, indent=4)
+
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -23,19 +23,53 @@ parser.add_argument('--verbose', help='Print computation progress.', action='sto
 # Optional
 parser.add_argument('--conf_dir', help='Specify configuration files directory, if you have some custom ones.')
 parser.add_argument('--dump_conf', help='Dump default config as json files.', action='store_true')
-
-process_order = ('pdf', 'image', 'chronicle', 'ocr', 'pos')
-
-args = parser.parse_args()
+parser.add_argument('--tagger_dir', help='Installation directory of TreeTagger.')
+parser.add_argument('--pos_format', help='Output format of POS results.', choices=('json', 'jsonl', 'columnar'))
+parser.add_argument('--engine', help='Text box detection engine.', choices=('numpy', 'python', 'pyramid'))
+parser.add_argument('--pixel_type', help='Load pages as floats or as 8 bit grey levels.', choices=('float', 'uint8'))
+parser.add_argument('--jobs', help='Number of worker processes.', type=int, default=1)
+parser.add_argument('--pages', help='Rasterize only pages FIRST-LAST of each pdf, e.g. 10-20.')
+parser.add_argument('--incremental', help='Only process input that changed since the last run.', action='store_true')
+parser.add_argument('--manifest_only', help='Write only layout manifests, no crop images.', action='store_true')
+parser.add_argument('--crop_format', help='Encoding of crop images, image_type by default.',
+                    choices=('png', 'tif', 'npy'))
+parser.add_argument('--png_compression', help='Compression level 0-9 of png crops.', type=int, choices=range(10))
+parser.add_argument('--writer_threads', help='Number of threads writing crops, 0 writes synchronously.', type=int)
+parser.add_argument('--container', help='Store the crops of each document in one zip file.', action='store_true')
+parser.add_argument('--stream', help='Stream each page through all stages in memory.', action='store_true')
+parser.add_argument('--keep', help='Write intermediate output of these stages in stream mode.', nargs='+',
+                    choices=('pdf', 'image', 'chronicle', 'ocr', 'pos'), default=[])
+parser.add_argument('--shard', help='Process only part I of N of the pages, e.g. 0/4, see merge_shards.py.')
+parser.add_argument('--serve', help='Keep running and process jobs of client.py on this localhost port.', type=int)
+parser.add_argument('--metrics', help='Write timing, memory and counters of every stage to this json file.')
+parser.add_argument('--profile', help='Dump cProfile stats of every stage to this directory.')
+
+
+def report_metrics(conf, args) -> None:
+    """
+    Prints the metrics summary and writes the metrics file, if asked for.
+    """
+    if args.metrics or args.profile or conf.verbose:
+        print("### Metrics ###")
+        print(conf.metrics.summary())
+    if args.metrics:
+        conf.metrics.dump(args.metrics)
+    if args.profile:
+        print("   cProfile stats written to " + args.profile)
+    if args.shard:
+        path = conf.shard.dump(conf.out_dir, conf.metrics)
+        if conf.verbose:
+            print("   Shard report written to " + path)
 
 
 def main():
-    from app.chronicle_processor import ChronicleProcessor
-    from app.layout_processor import ImageProcessor
-    from app.ocr_processor import OCRProcessor
-    from app.pdf_processor import PDFProcessor
-    from app.pos_processor import POSProcessor
     from app.config import Config
+    from app.metrics import Metrics
+    from app.pipeline import Pipeline
+    from app.pipeline import process_order
+    from app.shard import Shard
+
+    args = parser.parse_args()
 
     conf = Config(in_dir=args.input_dir,
                   out_dir=args.output_dir,
@@ -53,52 +87,61 @@ def main():
         conf.verbose = True
     if args.dump_conf:
         conf.dump_conf = args.dump_conf
-
-    if args.pdf:
-        pdf_processor = PDFProcessor(conf)
-    else:
-        pdf_processor = None
-
-    if args.image:
-        image_processor = ImageProcessor(conf)
-    else:
-        image_processor = None
-
-    if args.chronicle:
-        order_chronicle = ChronicleProcessor(conf)
-    else:
-        order_chronicle = None
-
-    if args.ocr:
-        ocr_processor = OCRProcessor(conf)
-    else:
-        ocr_processor = None
-
-    if args.pos:
-        pos_processor = POSProcessor(conf)
-    else:
-        pos_processor = None
-
-    ops = (pdf_processor,
-           image_processor,
-           order_chronicle,
-           ocr_processor,
-           pos_processor)
+    if args.tagger_dir:
+        conf.params_tagger['tagger_dir'] = args.tagger_dir
+    if args.pos_format:
+        conf.pos_format = args.pos_format
+    if args.engine:
+        conf.text_box_engine = args.engine
+    if args.pixel_type:
+        conf.pixel_type = args.pixel_type
+    if args.jobs:
+        conf.jobs = args.jobs
+    if args.pages:
+        first, __, last = args.pages.partition('-')
+        conf.page_range = (int(first), int(last) if last else None)
+    if args.incremental:
+        conf.incremental = True
+    if args.manifest_only:
+        conf.write_crops = False
+    if args.crop_format:
+        conf.crop_format = args.crop_format
+    if args.png_compression is not None:
+        conf.png_compression = args.png_compression
+    if args.writer_threads is not None:
+        conf.writer_threads = args.writer_threads
+    if args.container:
+        conf.crop_container = True
+    if args.keep:
+        conf.stream_keep = tuple(args.keep)
+    if args.profile:
+        conf.metrics = Metrics(profile_dir=args.profile)
+    if args.shard:
+        conf.shard = Shard.parse(args.shard)
+
+    if args.serve:
+        from app.service import serve
+        serve(conf, args.serve)
+        return
+
+    stages = [stage for stage in process_order if getattr(args, stage)]
+    if not stages:
+        print('You must specify at least one of the following: pdf, image, chronicle, ocr or pos!')
+        exit(0)
 
     if conf.verbose:
         print("### Starting Processing ###")
 
-    if not any(ops):
-        print('You must specify at least one of the following: pdf, image, chronicle, ocr or pos!')
-        exit(0)
+    if args.stream:
+        from app.stream_processor import StreamProcessor
+        StreamProcessor(conf, stages).run()
+    else:
+        result = Pipeline(conf, stages).run(in_dir=conf.in_dir, out_dir=conf.out_dir,
+                                            metrics=conf.metrics, shard=conf.shard)
+        for error in result['errors']:
+            print("Could not run {0}: {1}".format(error['stage'], error['error']))
 
-    for o in ops:
-        if o:
-            try:
-                o.run()
-            except Exception as e:
-                print("Could not run {0}: {1}".format(repr(o), repr(e)))
-                continue
+    report_metrics(conf, args)
 
     if conf.verbose:
         print("### Processing terminated ###")
@@ -0,0 +1,80 @@
+# coding=utf-8
+
+
+"""
+Checks when the build cache finds a work item current.
+
+Run with: python -m unittest discover tests
+"""
+
+import tempfile
+import unittest
+from os import remove
+from os.path import join
+
+from app.build_cache import BuildCache
+
+
+def write(path: str, text: str) -> str:
+    with open(path, mode='w', encoding='utf-8') as fp:
+        fp.write(text)
+    return path
+
+
+class BuildCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        self.input = write(join(self.root, '1.png'), 'page')
+        self.output = write(join(self.root, '1.txt'), 'text')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def __recorded(self, params=None) -> BuildCache:
+        cache = BuildCache(self.root, 'ocr', params or {'lang': 'fra'})
+        cache.record('1', cache.outdated('1', [self.input], [self.output]))
+        cache.save()
+        return BuildCache(self.root, 'ocr', params or {'lang': 'fra'})
+
+    def test_new_item_is_outdated(self):
+        cache = BuildCache(self.root, 'ocr', {'lang': 'fra'})
+        self.assertTrue(cache.outdated('1', [self.input], [self.output]))
+
+    def test_recorded_item_is_current(self):
+        self.assertIsNone(self.__recorded().outdated('1', [self.input], [self.output]))
+
+    def test_changed_input(self):
+        cache = self.__recorded()
+        write(self.input, 'corrected page')
+        self.assertTrue(cache.outdated('1', [self.input], [self.output]))
+
+    def test_changed_params(self):
+        self.__recorded()
+        cache = BuildCache(self.root, 'ocr', {'lang': 'deu'})
+        self.assertTrue(cache.outdated('1', [self.input], [self.output]))
+
+    def test_missing_output(self):
+        cache = self.__recorded()
+        remove(self.output)
+        self.assertTrue(cache.outdated('1', [self.input], [self.output]))
+
+    def test_missing_input(self):
+        cache = self.__recorded()
+        remove(self.input)
+        digest = cache.outdated('1', [self.input], [self.output])
+        self.assertEqual(digest, BuildCache.missing)
+        # Recording the rebuilt item drops it, it is outdated until its input is back.
+        cache.record('1', digest)
+        self.assertNotIn('1', cache.entries)
+
+    def test_stages_and_files_kept_apart(self):
+        self.__recorded()
+        self.assertTrue(BuildCache(self.root, 'pos', {'lang': 'fra'}).outdated('1', [self.input], [self.output]))
+        shard_cache = BuildCache(self.root, 'ocr', {'lang': 'fra'}, file_name='.build_manifest.1-of-2.json')
+        self.assertTrue(shard_cache.outdated('1', [self.input], [self.output]))
+
+
+if __name__ == '__main__':
+    unittest.main()
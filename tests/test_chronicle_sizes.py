@@ -0,0 +1,85 @@
+# coding=utf-8
+
+
+"""
+Checks the image sizes read from headers and the assignment of the chronicle
+text parts against the original loop over the components of a page.
+
+Run with: python -m unittest discover tests
+"""
+
+import tempfile
+import unittest
+from os.path import join
+
+import numpy as np
+
+from app.chronicle_processor import ChronicleProcessor
+from app.util import image_size
+
+
+def reference_fragments(widths: list, page_width: int) -> dict:
+    """
+    Text parts of the original loop, as component indices.
+    """
+    fragments = {'political': [], 'misc': [], 'eccles': [], 'footnotes': []}
+    for i, width in enumerate(widths):
+        if width / page_width >= 0.5 and not (fragments['misc'] or fragments['eccles']) and i < len(widths) - 1:
+            fragments['political'].append(i)
+            continue
+        if (width / page_width < 0.5) and not fragments['misc']:
+            fragments['misc'].append(i)
+            continue
+        if (width / page_width < 0.5) and not fragments['eccles']:
+            fragments['eccles'].append(i)
+            continue
+        if (width / page_width >= 0.5) and i >= len(widths) - 2:
+            fragments['footnotes'].append(i)
+            continue
+    return fragments
+
+
+class ImageSizeTest(unittest.TestCase):
+
+    def test_formats(self):
+        from PIL import Image
+
+        image = np.random.RandomState(0).randint(0, 256, size=(37, 53), dtype=np.uint8)
+        with tempfile.TemporaryDirectory() as tmp:
+            for ext, fmt in (('png', 'PNG'), ('tif', 'TIFF'), ('jpg', 'JPEG')):
+                path = join(tmp, 'page.' + ext)
+                Image.fromarray(image).save(path, format=fmt)
+                self.assertEqual(image_size(path), (37, 53), ext)
+            path = join(tmp, 'page.npy')
+            np.save(path, image)
+            self.assertEqual(image_size(path), (37, 53))
+            path = join(tmp, 'rgb.png')
+            Image.fromarray(np.zeros((41, 7, 3), dtype=np.uint8)).save(path)
+            self.assertEqual(image_size(path), (41, 7))
+
+    def test_missing_file(self):
+        with self.assertRaises(Exception):
+            image_size('/nonexistent/page.png')
+
+
+class AssignVolumeTest(unittest.TestCase):
+
+    def test_like_original_loop(self):
+        rng = np.random.RandomState(0)
+        page_widths = [int(rng.randint(800, 1200)) for __ in range(200)]
+        # Many widths close to half of the page, and pages without or with one component.
+        widths = [[int(rng.randint(0, page_width + 1)) for __ in range(rng.randint(0, 9))]
+                  for page_width in page_widths]
+        widths[0] = [page_widths[0] // 2, (page_widths[0] + 1) // 2, page_widths[0] // 2 - 1]
+        fragments = ChronicleProcessor.assign_volume(widths, page_widths)
+        self.assertEqual(len(fragments), len(widths))
+        for i, (page, page_width) in enumerate(zip(widths, page_widths)):
+            self.assertEqual(fragments[i], reference_fragments(page, page_width), 'page {0}: {1}'.format(i, page))
+
+    def test_assign_fragments(self):
+        self.assertEqual(ChronicleProcessor.assign_fragments([900, 900, 300, 300, 900, 900], 1000),
+                         {'political': [0, 1], 'misc': [2], 'eccles': [3], 'footnotes': [4, 5]})
+
+
+if __name__ == '__main__':
+    unittest.main()
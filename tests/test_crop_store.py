@@ -0,0 +1,94 @@
+# coding=utf-8
+
+
+"""
+Checks that crops are read back from the container of a document as written.
+
+Run with: python -m unittest discover tests
+"""
+
+import pickle
+import tempfile
+import unittest
+from os import listdir
+
+import numpy as np
+
+from app.crop_store import CropCollector
+from app.crop_store import CropStore
+from app.crop_store import CropStoreWriter
+from app.crop_store import crop_entry
+from app.crop_writer import CropWriter
+
+
+def sample_crop(seed: int) -> np.ndarray:
+    return np.random.RandomState(seed).randint(0, 256, size=(17 + seed, 31), dtype=np.uint8)
+
+
+class CropStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.doc_dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def __write(self, crops: dict, pages: list) -> None:
+        """
+        Writes crops {entry: image} through a CropWriter, like the image stage.
+        """
+        store = CropStoreWriter(self.doc_dir)
+        for page_no in pages:
+            store.page(page_no)
+        writer = CropWriter(2, 4)
+        for entry, image in crops.items():
+            writer.write(self.doc_dir + '/' + entry, image, store)
+        self.assertEqual(writer.close(), [])
+        self.assertTrue(store.close())
+
+    def __read(self) -> dict:
+        store = CropStore(self.doc_dir)
+        try:
+            return {entry: store.read(entry) for entry in store.entries()}
+        finally:
+            store.close()
+
+    def test_round_trip(self):
+        # png, tif and npy are lossless.
+        crops = {crop_entry('1', '1.png'): sample_crop(1),
+                 crop_entry('1', '2.tif'): sample_crop(2),
+                 crop_entry('2', '1.npy'): sample_crop(3)}
+        self.__write(crops, ['1', '2'])
+        read = self.__read()
+        self.assertEqual(sorted(read), sorted(crops))
+        for entry, image in crops.items():
+            np.testing.assert_array_equal(read[entry], image, entry)
+        self.assertEqual(listdir(self.doc_dir), ['crops.zip'])
+
+    def test_pages_replaced(self):
+        self.__write({'1/1.png': sample_crop(1), '1/2.png': sample_crop(2), '2/1.png': sample_crop(3)}, ['1', '2'])
+        # Page 1 is written again with one crop, page 2 is kept.
+        self.__write({'1/1.png': sample_crop(4)}, ['1'])
+        read = self.__read()
+        self.assertEqual(sorted(read), ['1/1.png', '2/1.png'])
+        np.testing.assert_array_equal(read['1/1.png'], sample_crop(4))
+        np.testing.assert_array_equal(read['2/1.png'], sample_crop(3))
+
+    def test_collector(self):
+        # Crops of a worker process are pickled and added by the parent.
+        collector = CropCollector()
+        collector.page('3')
+        collector.add(self.doc_dir + '/3/1.png', b'encoded')
+        collector = pickle.loads(pickle.dumps(collector))
+        store = CropStoreWriter(self.doc_dir)
+        collector.replay(store)
+        store.close()
+        self.assertEqual(store.pages, {'3'})
+        reader = CropStore(self.doc_dir)
+        self.assertEqual(reader.read_bytes('3/1.png'), b'encoded')
+        reader.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
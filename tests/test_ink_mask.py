@@ -0,0 +1,54 @@
+# coding=utf-8
+
+
+"""
+Checks the counts and regions of the bit-packed ink mask against the boolean mask.
+
+Run with: python -m unittest discover tests
+"""
+
+import unittest
+
+import numpy as np
+
+from app.ink_mask import InkMask
+
+
+class InkMaskTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.ink = np.random.RandomState(0).random_sample((13, 29)) < 0.4
+        cls.mask = InkMask(cls.ink)
+
+    def test_row_counts(self):
+        # Every column range, with both ends in the same byte, in neighbouring and in distant bytes.
+        height, width = self.ink.shape
+        for left in range(width + 1):
+            for right in range(left, width + 1):
+                np.testing.assert_array_equal(self.mask.row_counts(2, 11, left, right),
+                                              self.ink[2:11, left:right].sum(axis=1), '{0}:{1}'.format(left, right))
+        np.testing.assert_array_equal(self.mask.row_counts(0, height, 0, width), self.ink.sum(axis=1))
+
+    def test_empty_ranges(self):
+        self.assertEqual(self.mask.row_counts(3, 7, 9, 9).tolist(), [0, 0, 0, 0])
+        self.assertEqual(self.mask.row_counts(3, 7, 9, 4).tolist(), [0, 0, 0, 0])
+        self.assertEqual(self.mask.row_counts(7, 3, 0, 8).tolist(), [])
+
+    def test_unpack(self):
+        np.testing.assert_array_equal(self.mask.unpack(1, 12, 3, 27), self.ink[1:12, 3:27])
+        rows = np.array([0, 5, 12])
+        np.testing.assert_array_equal(self.mask.unpack_rows(rows, 9, 17), self.ink[rows, 9:17])
+
+    def test_block_any(self):
+        # The last block of a row or column may be cut off by the region.
+        region = self.ink[1:12, 5:26]
+        expected = np.zeros((4, 7), dtype=bool)
+        for row in range(4):
+            for col in range(7):
+                expected[row, col] = region[3 * row:3 * row + 3, 3 * col:3 * col + 3].any()
+        np.testing.assert_array_equal(self.mask.block_any(1, 12, 5, 26, 3), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
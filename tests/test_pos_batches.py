@@ -0,0 +1,70 @@
+# coding=utf-8
+
+
+"""
+Checks that a batch of texts tagged in one TreeTagger call is split back into one result per text.
+
+The TreeTagger program is replaced by a tagger that answers like it: one line
+of word, pos and lemma per token, SGML tags passed through on their own line.
+
+Run with: python -m unittest discover tests
+"""
+
+import unittest
+
+from app.config import Config
+from app.pos_processor import POSProcessor
+
+
+class LineTagger:
+    """
+    Tags every whitespace separated token as NOM, with its lower case as lemma.
+    """
+
+    def __init__(self, drop_tags=False):
+        self.drop_tags = drop_tags
+        self.calls = 0
+
+    def tag_text(self, text: str) -> list:
+        self.calls += 1
+        lines = []
+        for token in text.split():
+            if token.startswith('<') and token.endswith('>'):
+                if not self.drop_tags:
+                    lines.append(token)
+                continue
+            lines.append('{0}\tNOM\t{1}'.format(token, token.lower()))
+        return lines
+
+
+def expected_tags(text: str) -> list:
+    return [{'word': word, 'pos': 'NOM', 'lemma': word.lower()}
+            for word in text.split() if not (word.startswith('<') and word.endswith('>'))]
+
+
+class TagTextsTest(unittest.TestCase):
+
+    def __processor(self, tagger: LineTagger) -> POSProcessor:
+        processor = POSProcessor(Config(in_dir='.', out_dir='.', lang='fra', dpi='75', image_type='png'))
+        processor._POSProcessor__taggers['fr'] = tagger
+        return processor
+
+    def test_split(self):
+        tagger = LineTagger()
+        texts = ['Le Roi de France', '', 'Paris\n\n', 'une <b> balise', '   ', 'Fin']
+        tags = self.__processor(tagger).tag_texts(texts, 'fr')
+        self.assertEqual(tagger.calls, 1)
+        self.assertEqual(tags, [expected_tags(text) for text in texts])
+
+    def test_single_and_empty(self):
+        processor = self.__processor(LineTagger())
+        self.assertEqual(processor.tag_texts([], 'fr'), [])
+        self.assertEqual(processor.tag_text('Chronique', 'fr'), expected_tags('Chronique'))
+
+    def test_lost_boundary(self):
+        with self.assertRaises(Exception):
+            self.__processor(LineTagger(drop_tags=True)).tag_texts(['a', 'b'], 'fr')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+# coding=utf-8
+
+
+"""
+Checks that pos results are read back as written, also after the format changed.
+
+Run with: python -m unittest discover tests
+"""
+
+import tempfile
+import unittest
+from os import listdir
+
+from app.pos_store import page_pos_files
+from app.pos_store import pos_formats
+from app.pos_store import read_pos_results
+from app.pos_store import write_pos_results
+
+
+def sample_results(word: str) -> list:
+    return [('1_a', [{'word': word, 'pos': 'NOM', 'lemma': word.lower()},
+                     {'word': 'de', 'pos': 'PRP', 'lemma': 'de'}]),
+            ('2_b', [{'word': 'Paris', 'pos': 'NAM', 'lemma': 'Paris'}]),
+            ('10', [])]
+
+
+class PosStoreTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for pos_format in pos_formats:
+            with tempfile.TemporaryDirectory() as page_dir:
+                results = sample_results('Chronique')
+                write_pos_results(page_dir, results, pos_format)
+                self.assertEqual(read_pos_results(page_dir), dict(results), pos_format)
+
+    def test_format_switch(self):
+        for old_format in pos_formats:
+            for new_format in pos_formats:
+                with tempfile.TemporaryDirectory() as page_dir:
+                    write_pos_results(page_dir, sample_results('Ancien'), old_format)
+                    results = sample_results('Nouveau')[:2]
+                    write_pos_results(page_dir, results, new_format)
+                    message = '{0} -> {1}: {2}'.format(old_format, new_format, listdir(page_dir))
+                    self.assertEqual(read_pos_results(page_dir), dict(results), message)
+                    self.assertEqual(len(page_pos_files(page_dir)), 2 if new_format == 'json' else 1, message)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+# coding=utf-8
+
+
+"""
+Checks the split of work items across shards and the check of their reports by merge_shards.py.
+
+Run with: python -m unittest discover tests
+"""
+
+import unittest
+
+from app.shard import Shard
+from app.shard import page_key
+from merge_shards import verify
+
+
+pages = ['vol{0}/{1}'.format(doc, page) for doc in range(1, 4) for page in range(1, 9)]
+
+
+def shard_report(shard: Shard) -> dict:
+    return {'shard': [shard.index, shard.count], 'stages': shard.stages, 'metrics': None}
+
+
+def sharded_run(count: int, ocr_pages=None) -> list:
+    """
+    Reports of count shards that ran the image and the ocr stage on all pages,
+    the ocr stage found the page directories in ocr_pages only.
+    """
+    reports = []
+    for index in range(count):
+        shard = Shard(index, count)
+        for key in shard.select('image', pages, key=lambda key: key):
+            shard.done('image', key)
+        for key in shard.select('ocr', ocr_pages if ocr_pages is not None else pages, key=lambda key: key):
+            shard.done('ocr', key)
+        reports.append(shard_report(shard))
+    return reports
+
+
+class ShardTest(unittest.TestCase):
+
+    def test_every_page_in_one_shard(self):
+        for count in (1, 2, 3, 5):
+            owners = [[index for index in range(count) if Shard(index, count).owns(key)] for key in pages]
+            self.assertTrue(all(len(owner) == 1 for owner in owners), count)
+            self.assertEqual({owner[0] for owner in owners}, set(range(count)), count)
+
+    def test_keys(self):
+        shard = Shard(keys=['vol1/3', 'vol2'])
+        self.assertEqual([key for key in pages if shard.owns(key)],
+                         ['vol1/3'] + ['vol2/{0}'.format(page) for page in range(1, 9)])
+
+    def test_total_of_first_stage_only(self):
+        shard = Shard(0, 2)
+        shard.select('image', pages, key=lambda key: key)
+        shard.select('ocr', pages, key=lambda key: key)
+        self.assertEqual(shard.stages['image']['total'], len(pages))
+        self.assertIsNone(shard.stages['ocr']['total'])
+
+    def test_file_name(self):
+        self.assertEqual(Shard().file_name('crops.zip'), 'crops.zip')
+        self.assertEqual(Shard(1, 4).file_name('crops.zip'), 'crops.1-of-4.zip')
+
+    def test_page_key(self):
+        self.assertEqual(page_key('/tree/vol1/12.png'), 'vol1/12')
+        self.assertEqual(page_key('/tree/vol1/12/'), 'vol1/12')
+
+    def test_verify_complete_run(self):
+        problems, items = verify(sharded_run(3))
+        self.assertEqual(problems, [])
+        self.assertEqual(items['image'], {'items': len(pages), 'done': len(pages), 'skipped': 0})
+        self.assertEqual(items['ocr'], {'items': len(pages), 'done': len(pages), 'skipped': 0})
+
+    def test_verify_missing_report(self):
+        problems, __ = verify(sharded_run(3)[1:])
+        self.assertIn('Report of shard 0/3 is missing', problems)
+
+    def test_verify_duplicate_report(self):
+        reports = sharded_run(2)
+        problems, __ = verify(reports + reports[:1])
+        self.assertIn('Shard 0/2 reported 2 times', problems)
+
+    def test_verify_unprocessed_item(self):
+        reports = sharded_run(2)
+        key = reports[1]['stages']['image']['done'].pop()
+        problems, __ = verify(reports)
+        self.assertEqual(problems, ['image: {0} of shard 1/2 was not processed'.format(key)])
+
+    def test_verify_unseen_page(self):
+        problems, __ = verify(sharded_run(2, ocr_pages=pages[1:]))
+        self.assertEqual(problems, ['ocr: page {0} was not seen by any shard'.format(pages[0])])
+
+
+if __name__ == '__main__':
+    unittest.main()
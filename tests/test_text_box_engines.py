@@ -0,0 +1,165 @@
+# coding=utf-8
+
+
+"""
+Checks that the text box engines cut pages exactly like the original Python loop,
+and the pyramid engine clean pages like the numpy engine.
+
+Run with: python -m unittest discover tests
+"""
+
+import unittest
+from math import ceil
+from math import floor
+from math import log
+
+import numpy as np
+
+from app.config import Config
+from app.layout_processor import ImageProcessor
+from app.synthetic_pages import make_page
+
+
+def _dense(black_pixels: list, max_distance: float, density_filter: int) -> bool:
+    if not black_pixels or len(black_pixels) < density_filter:
+        return False
+    black_pixels = black_pixels[::-1]
+    distances = [log(black_pixels[i] - black_pixels[i + 1]) for i in range(len(black_pixels) - 1)]
+    return floor(sum(distances) / len(black_pixels)) <= ceil(max_distance)
+
+
+def reference_cuts(conf: Config, image: np.ndarray, vertical=False) -> list:
+    """
+    Cut positions of the original pixel by pixel loop. The rotation by
+    skimage.transform.rotate(image, 270, resize=True) is done exactly with np.rot90.
+    """
+    if image.ndim > 2 or 0 in image.shape:
+        return []
+    params = conf.set_params_text_box(image.shape)
+    dim1, dim2 = image.shape
+    if vertical and max(dim1, dim2) / min(dim1, dim2) > params['min_crop_ratio']:
+        return []
+    image_copy = np.rot90(image, -1) if vertical else image
+    dim1, dim2 = image_copy.shape
+
+    state_in = False
+    curr_white_lines = 0
+    cut_positions = []
+    last_col = dim2 - params['horizontal_margin'] - 1
+    for row in range(params['vertical_margin'], dim1 - params['vertical_margin']):
+        black_pixels_read = []
+        for col in range(params['horizontal_margin'], dim2 - params['horizontal_margin']):
+            if image_copy[row, col] <= params['black_value']:
+                black_pixels_read.append(col)
+            if col != last_col:
+                continue
+            dense = _dense(black_pixels_read, params['max_distance'], params['density_filter'])
+            if state_in:
+                curr_white_lines = 0 if dense else curr_white_lines + 1
+                if curr_white_lines >= params['min_white_lines']:
+                    curr_white_lines = 0
+                    state_in = False
+                    lower, upper = ('correction_left', 'correction_right') if vertical else \
+                        ('correction_upper', 'correction_lower')
+                    cut_positions[-1] = (floor(cut_positions[-1][0] + params[lower]),
+                                         floor(row + params[upper]))
+            elif dense:
+                state_in = True
+                cut_positions.append((row, None))
+    return [pos for pos in cut_positions if None not in pos]
+
+
+def reference_boxes(conf: Config, image: np.ndarray) -> list:
+    """
+    Text boxes of the original cutting, as (top, bottom, left, right) of the page.
+    """
+    params = conf.params_text_cut
+    height, width = image.shape
+    horizontal_cuts = reference_cuts(conf, image)
+    if not horizontal_cuts or len(horizontal_cuts) > params['max_no_of_hor_cuts']:
+        return [(0, height, 0, width)]
+
+    boxes = []
+    for x_in, x_out in horizontal_cuts:
+        x_in, x_out = int(x_in), int(x_out)
+        if abs(x_out - x_in) < height * params['filter_small_hor']:
+            continue
+        top, bottom, __ = slice(x_in, x_out).indices(height)
+        bottom = max(top, bottom)
+        vertical_cuts = reference_cuts(conf, image[x_in:x_out], vertical=True)
+        if not vertical_cuts or len(vertical_cuts) > params['max_no_of_ver_cuts']:
+            boxes.append((top, bottom, 0, width))
+            continue
+        for y_in, y_out in vertical_cuts:
+            y_in, y_out = int(y_in), int(y_out)
+            if abs(y_out - y_in) < width * params['filter_small_ver']:
+                break
+            left, right, __ = slice(y_in, y_out).indices(width)
+            boxes.append((top, bottom, left, max(left, right)))
+    return boxes
+
+
+def sample_pages() -> list:
+    """
+    Small synthetic pages as 8 bit grey levels, some with grey speckle noise.
+    """
+    pages = []
+    for seed in range(6):
+        page, __ = make_page(dpi=(50, 75, 100)[seed % 3], seed=seed, columns=seed != 1, footnotes=seed != 4)
+        if seed >= 3:
+            rng = np.random.RandomState(seed)
+            noise = rng.random_sample(page.shape) < 0.02
+            page[noise] = rng.randint(0, 60, size=int(noise.sum()))
+        pages.append(page)
+    return pages
+
+
+class TextBoxEngineTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pages = sample_pages()
+
+    @staticmethod
+    def __conf(engine: str, pixel_type: str) -> Config:
+        conf = Config(in_dir='.', out_dir='.', lang='fra', dpi='75', image_type='png')
+        conf.text_box_engine = engine
+        conf.pixel_type = pixel_type
+        return conf
+
+    def __check_engine(self, engine: str, pixel_type: str, float_pages: bool):
+        conf = self.__conf(engine, pixel_type)
+        processor = ImageProcessor(conf)
+        for i, page in enumerate(self.pages):
+            image = page / 255.0 if float_pages else page
+            expected = reference_boxes(conf, page / 255.0)
+            self.assertGreater(len(expected), 1)
+            self.assertEqual(processor.text_boxes(image), expected, 'page {0}'.format(i))
+
+    def test_python_engine(self):
+        self.__check_engine('python', 'float', float_pages=True)
+
+    def test_numpy_engine(self):
+        self.__check_engine('numpy', 'float', float_pages=True)
+
+    def test_numpy_engine_uint8(self):
+        self.__check_engine('numpy', 'uint8', float_pages=False)
+
+    def test_python_engine_uint8(self):
+        self.__check_engine('python', 'uint8', float_pages=False)
+
+    def test_pyramid_engine(self):
+        # Heavy noise may merge boxes of the pyramid engine, it must agree on the clean pages only.
+        pages = self.pages[:3] + [make_page(dpi=150, seed=6)[0]]
+        for pixel_type in ('float', 'uint8'):
+            numpy_processor = ImageProcessor(self.__conf('numpy', pixel_type))
+            pyramid_processor = ImageProcessor(self.__conf('pyramid', pixel_type))
+            for i, page in enumerate(pages):
+                image = page / 255.0 if pixel_type == 'float' else page
+                expected = numpy_processor.text_boxes(image)
+                self.assertGreater(len(expected), 1)
+                self.assertEqual(pyramid_processor.text_boxes(image), expected, '{0} page {1}'.format(pixel_type, i))
+
+
+if __name__ == '__main__':
+    unittest.main()